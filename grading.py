@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+'''
+Części sprawdzarek wspólne dla wszystkich list: historia ocen (SQLite),
+kalibracja limitów czasowych, porównywanie rozwiązań (`--compare`) i zapis
+wyników w formacie JSON. Sprawdzarki wczytują ten moduł z katalogu
+nadrzędnego dopiero, gdy potrzebna jest któraś z tych opcji, więc samo
+sprawdzanie działa też w pojedynczym pliku sprawdzarki.
+
+Funkcje uruchamiające testy dostają `run_and_score_case` danej sprawdzarki
+i klasę wyjątku, którą zgłasza ona dla niezaliczonego testu.
+'''
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+import yaml
+
+
+# Reference solutions are run with generous timeouts during calibration.
+CALIBRATION_TIMEOUT_MULTIPLIER = 10.0
+# Shorter times are dominated by process startup and are not compared.
+CALIBRATION_MIN_TIME = 0.1
+# Cases without `ref_time` get timeouts at least this many times longer than
+# the reference solution takes on this machine.
+CALIBRATION_HEADROOM = 2.0
+
+# 97.5% quantiles of Student's t distribution for 1..30 degrees of freedom.
+T_QUANTILES_975 = [
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+
+def get_host_fingerprint():
+    return {
+        'node': platform.node(),
+        'system': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'python': platform.python_version(),
+        'cpu_count': multiprocessing.cpu_count(),
+        }
+
+
+def to_utf8(text):
+    if isinstance(text, bytes):
+        return text
+    return text.encode('utf8')
+
+
+def get_solution_hash(paths):
+    """
+    SHA-1 of the solution: the given paths together with the contents of
+    those that are files or directories.
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update(to_utf8(path))
+        if os.path.isfile(path):
+            file_paths = [path]
+        else:
+            file_paths = sorted(
+                os.path.join(dir_path, file_name)
+                for dir_path, _, file_names in os.walk(path)
+                for file_name in file_names
+                if not file_name.endswith('.pyc'))
+        for file_path in file_paths:
+            digest.update(to_utf8(file_path))
+            with open(file_path, 'rb') as solution_f:
+                digest.update(solution_f.read())
+    return digest.hexdigest()
+
+
+def write_json_record(json_f, record):
+    json_f.write(json.dumps(record, sort_keys=True) + '\n')
+    json_f.flush()
+
+
+def geometric_mean_interval(log_ratios):
+    """
+    Geometric mean of ratios given by their logarithms, with a 95% confidence
+    interval from Student's t distribution.
+    """
+    log_ratios = np.asarray(log_ratios, dtype=float)
+    mean = log_ratios.mean()
+    if len(log_ratios) < 2:
+        return np.exp(mean), np.nan, np.nan
+    dof = len(log_ratios) - 1
+    t = T_QUANTILES_975[dof - 1] if dof <= len(T_QUANTILES_975) else 1.96
+    half_width = t * log_ratios.std(ddof=1) / np.sqrt(len(log_ratios))
+    return np.exp(mean), np.exp(mean - half_width), np.exp(mean + half_width)
+
+
+def compare_programs(run_and_score_case, case_error, programs, defaults,
+                     problem_cases, validator, get_timeout_multiplier,
+                     repeats):
+    """
+    Run two programs on the same cases, alternating which one goes first so
+    that both see the same load, and report the speedup of the second one.
+    """
+    case_log_ratios = []
+    for case_num, case_def in problem_cases:
+        print('Comparing case %d... ' % (case_num,), end='')
+        sys.stdout.flush()
+        times = ([], [])
+        try:
+            for repeat in range(repeats):
+                for prog_num in ((0, 1) if repeat % 2 == 0 else (1, 0)):
+                    times[prog_num].append(run_and_score_case(
+                        programs[prog_num], defaults, case_def, validator,
+                        get_timeout_multiplier(case_num))['time'])
+        except case_error as e:
+            print('Failed (program %s):' % ('AB'[prog_num],))
+            print(str(e))
+            continue
+        log_ratios = np.log(times[0]) - np.log(times[1])
+        case_log_ratios.append(log_ratios.mean())
+        print('A %f s, B %f s, speedup %.3fx (95%% CI %.3f-%.3f)' % (
+            (np.median(times[0]), np.median(times[1])) +
+            geometric_mean_interval(log_ratios)))
+    if case_log_ratios:
+        print('\nGeometric mean speedup of B over A on %d cases: '
+              '%.3fx (95%% CI %.3f-%.3f)' % (
+                  (len(case_log_ratios),) +
+                  geometric_mean_interval(case_log_ratios)))
+
+
+HISTORY_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started REAL,
+    solution TEXT,
+    program TEXT,
+    testset TEXT,
+    problem TEXT,
+    host TEXT);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER,
+    solution TEXT,
+    testset TEXT,
+    problem TEXT,
+    case_num INTEGER,
+    status TEXT,
+    message TEXT,
+    time REAL);
+CREATE TABLE IF NOT EXISTS measurements (
+    run_id INTEGER,
+    solution TEXT,
+    testset TEXT,
+    problem TEXT,
+    case_num INTEGER,
+    name TEXT,
+    value REAL);
+CREATE INDEX IF NOT EXISTS results_key
+    ON results (solution, testset, problem, case_num);
+'''
+
+
+class GradingHistory(object):
+    """
+    SQLite store of case results and measurements, keyed by solution hash,
+    test set, problem and case.
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(HISTORY_SCHEMA)
+
+    def start_run(self, solution, program, testset, problem, host):
+        cursor = self.db.execute(
+            'INSERT INTO runs (started, solution, program, testset, problem, '
+            'host) VALUES (?, ?, ?, ?, ?, ?)',
+            (time.time(), solution, program, testset, problem,
+             json.dumps(host, sort_keys=True)))
+        self.db.commit()
+        self.run_key = (cursor.lastrowid, solution, testset, problem)
+        return self.run_key[0]
+
+    def add_result(self, case_num, message, measurements):
+        key = self.run_key + (case_num,)
+        self.db.execute(
+            'INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            key + ('failed' if message is not None else 'ok', message,
+                   measurements.get('time')))
+        self.db.executemany(
+            'INSERT INTO measurements VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [key + (name, value) for name, value in measurements.items()])
+        self.db.commit()
+
+    def _ok_times(self, testset, problem, solution=''):
+        """
+        Yields (solution, case_num, run_id, time) of passing cases in the order
+        in which they were graded.
+        """
+        return self.db.execute(
+            'SELECT solution, case_num, run_id, time FROM results '
+            'WHERE testset = ? AND problem = ? AND status = \'ok\' '
+            'AND solution LIKE ? ORDER BY run_id',
+            (testset, problem, solution + '%'))
+
+    def slowest_cases(self, testset, problem, solution='', limit=10):
+        return self.db.execute(
+            'SELECT solution, case_num, AVG(time), COUNT(*) FROM results '
+            'WHERE testset = ? AND problem = ? AND status = \'ok\' '
+            'AND solution LIKE ? GROUP BY solution, case_num '
+            'ORDER BY AVG(time) DESC LIMIT ?',
+            (testset, problem, solution + '%', limit)).fetchall()
+
+    def time_trend(self, testset, problem, solution=''):
+        return self.db.execute(
+            'SELECT runs.solution, runs.run_id, runs.started, '
+            'SUM(results.status = \'ok\'), COUNT(results.case_num), '
+            'SUM(results.time) FROM runs JOIN results USING (run_id) '
+            'WHERE runs.testset = ? AND runs.problem = ? '
+            'AND runs.solution LIKE ? '
+            'GROUP BY runs.run_id ORDER BY runs.solution, runs.run_id',
+            (testset, problem, solution + '%')).fetchall()
+
+    def regressions(self, testset, problem, threshold, solution=''):
+        """
+        Cases whose latest passing time exceeds the best earlier one by more
+        than `threshold` percent.
+        """
+        times = {}
+        for sol, case_num, _, case_time in self._ok_times(
+                testset, problem, solution):
+            times.setdefault((sol, case_num), []).append(case_time)
+        regressed = []
+        for (sol, case_num), case_times in sorted(times.items()):
+            if len(case_times) < 2:
+                continue
+            best, latest = min(case_times[:-1]), case_times[-1]
+            if latest > best * (1.0 + threshold / 100.0):
+                regressed.append((sol, case_num, best, latest))
+        return regressed
+
+    def case_order(self, testset, problem, case_nums):
+        """
+        Order cases so that the ones that failed most often for any solution
+        come first, followed by the ones that took the longest. Cases without
+        history are treated as failing.
+        """
+        stats = {}
+        for case_num, failed, mean_time in self.db.execute(
+                'SELECT case_num, AVG(status = \'failed\'), AVG(time) '
+                'FROM results WHERE testset = ? AND problem = ? '
+                'GROUP BY case_num', (testset, problem)):
+            stats[case_num] = (-failed, -(mean_time or 0.0))
+        return sorted(case_nums, key=lambda n: stats.get(n, (-1.0, 0.0)))
+
+
+def print_history_report(history, report, testset, problem, solution,
+                         threshold):
+    if report == 'slowest':
+        for sol, case_num, mean_time, runs in history.slowest_cases(
+                testset, problem, solution):
+            print('%s case %d: mean time %f over %d runs' % (
+                sol[:12], case_num, mean_time, runs))
+    elif report == 'trend':
+        for sol, run_id, started, passed, total, tot_time in (
+                history.time_trend(testset, problem, solution)):
+            print('%s run %d (%s): %d/%d cases pass, total time %f' % (
+                sol[:12], run_id,
+                time.strftime('%Y-%m-%d %H:%M', time.localtime(started)),
+                passed, total, tot_time or 0.0))
+    elif report == 'regressions':
+        for sol, case_num, best, latest in history.regressions(
+                testset, problem, threshold, solution):
+            print('%s case %d: %f -> %f (+%.1f%%)' % (
+                sol[:12], case_num, best, latest,
+                (latest / best - 1.0) * 100.0))
+
+
+def load_calibration(calibration_file):
+    if not os.path.isfile(calibration_file):
+        return {}
+    with open(calibration_file) as calibration_f:
+        return yaml.safe_load(calibration_f) or {}
+
+
+def get_case_scale(calibration, testset_key, problem, case_num, default=1.0):
+    """
+    Timeout scale for a case: its calibrated factor, the median factor of the
+    problem for cases that were not calibrated, or `default`.
+    """
+    factors = calibration.get(testset_key, {}).get(problem) or {}
+    if case_num in factors:
+        return factors[case_num]
+    if factors:
+        return float(np.median(list(factors.values())))
+    return default
+
+
+def calibrate_cases(run_and_score_case, case_error, program, defaults,
+                    problem_cases, validator, repeats):
+    """
+    Run a reference solution and compare its time with the `ref_time` of each
+    case, i.e. the time it took on the machine the timeouts were tuned on.
+    Cases without `ref_time` (none of the shipped ones has it) are scaled so
+    that the timeout leaves the reference solution CALIBRATION_HEADROOM;
+    their timeouts are only extended, never shortened.
+    """
+    factors = {}
+    for case_num, case_def in problem_cases:
+        print('Calibrating case %d... ' % (case_num,), end='')
+        sys.stdout.flush()
+        opts = dict(defaults, **case_def)
+        ref_time = opts.get('ref_time')
+        try:
+            host_time = min(
+                run_and_score_case(
+                    program, defaults, case_def, validator,
+                    CALIBRATION_TIMEOUT_MULTIPLIER)['time']
+                for _ in range(repeats))
+        except case_error as e:
+            print('Failed:')
+            print(str(e))
+            continue
+        if ref_time is None:
+            timeout = opts.get('timeout') or 0
+            if timeout <= 0:
+                print('%f s, no ref_time and no timeout for this case.' % (
+                    host_time,))
+                continue
+            factors[case_num] = max(
+                1.0, CALIBRATION_HEADROOM * host_time / timeout)
+            print('%f s (timeout %f s), scale %f' % (
+                host_time, timeout, factors[case_num]))
+            continue
+        factors[case_num] = (max(host_time, CALIBRATION_MIN_TIME) /
+                             max(ref_time, CALIBRATION_MIN_TIME))
+        print('%f s (ref_time %f s), scale %f' % (
+            host_time, ref_time, factors[case_num]))
+    return factors
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+'''
+Generator poziomów Sokobana dla sprawdzarki. Przykład użycia:
+
+  `python sokoban_generator.py --count 20 --height 12 --width 14 --boxes 5 --output duze_testy.yaml`
+  `python validator.py --testset duze_testy.yaml zad2 python rozwiazanie.py`
+
+Poziomy powstają przez losowe "ciągnięcie" skrzynek z pól docelowych, więc
+zawsze są rozwiązywalne. Długość najkrótszego rozwiązania (pole `out`) jest
+wyznaczana rozwiązaniem wzorcowym z `validator.py`.
+'''
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import multiprocessing
+import random
+import sys
+
+import validator
+from validator import Sokoban
+
+
+def random_walls(rng, height, width, wall_density):
+    """
+    Random walls with a wall border. Floor cells not connected to the largest
+    floor region are turned into walls.
+    """
+    walls = set()
+    for r in range(height):
+        for c in range(width):
+            if (r in (0, height - 1) or c in (0, width - 1) or
+                    rng.random() < wall_density):
+                walls.add((r, c))
+    regions = []
+    seen = set(walls)
+    for r in range(height):
+        for c in range(width):
+            if (r, c) in seen:
+                continue
+            region = [(r, c)]
+            seen.add((r, c))
+            for cr, cc in region:
+                for dr, dc in Sokoban.MOVES.values():
+                    if (cr + dr, cc + dc) not in seen:
+                        seen.add((cr + dr, cc + dc))
+                        region.append((cr + dr, cc + dc))
+            regions.append(region)
+    floor = max(regions, key=len) if regions else []
+    return walls | (seen - set(floor)), floor
+
+
+def random_pulls(rng, walls, keeper, boxes, num_steps):
+    """
+    Walk the keeper randomly, sometimes pulling the box behind it. Pulls are
+    pushes played backwards, so the boxes can be pushed back to the goals.
+    """
+    boxes = set(boxes)
+    moves = list(Sokoban.MOVES.values())
+    for _ in range(num_steps):
+        dr, dc = rng.choice(moves)
+        nk = (keeper[0] + dr, keeper[1] + dc)
+        if nk in walls or nk in boxes:
+            continue
+        behind = (keeper[0] - dr, keeper[1] - dc)
+        if behind in boxes and rng.random() < 0.5:
+            boxes.remove(behind)
+            boxes.add(keeper)
+        keeper = nk
+    return keeper, boxes
+
+
+def level_lines(height, width, walls, goals, keeper, boxes):
+    lines = []
+    for r in range(height):
+        line = []
+        for c in range(width):
+            if (r, c) in walls:
+                cell = Sokoban.WALL
+            elif (r, c) in boxes:
+                cell = Sokoban.BOX_ON_GOAL if (r, c) in goals else Sokoban.BOX
+            elif (r, c) == keeper:
+                cell = (Sokoban.KEEPER_ON_GOAL if (r, c) in goals
+                        else Sokoban.KEEPER)
+            else:
+                cell = Sokoban.GOAL if (r, c) in goals else Sokoban.EMPTY
+            line.append(Sokoban.id2char[cell])
+        lines.append(''.join(line))
+    return lines
+
+
+def generate_level(params):
+    """
+    Generate one solvable level whose shortest solution has at least
+    min_moves moves. Returns a test case, fails after max_attempts levels.
+    """
+    (seed, height, width, num_boxes, wall_density, num_pulls, min_moves,
+     max_memory, max_attempts) = params
+    rng = random.Random(seed)
+    for _ in range(max_attempts):
+        walls, floor = random_walls(rng, height, width, wall_density)
+        if len(floor) < 3 * num_boxes + 1:
+            continue
+        goals = set(rng.sample(floor, num_boxes))
+        keeper = rng.choice([f for f in floor if f not in goals])
+        keeper, boxes = random_pulls(rng, walls, keeper, goals, num_pulls)
+        if boxes == goals:
+            continue
+        case = {'inp': '\n'.join(
+            level_lines(height, width, walls, goals, keeper, boxes)) + '\n'}
+        try:
+            solution = validator.solve_sokoban_case(case, max_memory)
+        except validator.ValidatorException:
+            continue
+        if solution is not None and len(solution) >= min_moves:
+            case['out'] = len(solution)
+            case['size'] = num_boxes
+            return case
+    validator.fail(
+        'No level with %d boxes and at least %d moves found in %d attempts '
+        'on a %dx%d map (seed %s).' % (
+            num_boxes, min_moves, max_attempts, height, width, seed))
+
+
+def get_argparser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--count', default=10, type=int,
+        help='Number of levels to generate.')
+    parser.add_argument(
+        '--height', default=10, type=int,
+        help='Number of map rows, including the wall border.')
+    parser.add_argument(
+        '--width', default=10, type=int,
+        help='Number of map columns, including the wall border.')
+    parser.add_argument(
+        '--boxes', default=3, type=int,
+        help='Number of boxes.')
+    parser.add_argument(
+        '--wall-density', default=0.15, type=float,
+        help='Probability that an inner cell is a wall.')
+    parser.add_argument(
+        '--pulls', default=1000, type=int,
+        help='Number of random reverse keeper moves.')
+    parser.add_argument(
+        '--min-moves', default=20, type=int,
+        help='Reject levels with shorter solutions.')
+    parser.add_argument(
+        '--max-attempts', default=1000, type=int,
+        help='Give up after that many rejected levels for one test case.')
+    parser.add_argument(
+        '--solver-memory', default=2048, type=int,
+        help='Memory limit of the reference solver in MB, per process.')
+    parser.add_argument(
+        '--processes', default=multiprocessing.cpu_count(), type=int,
+        help='Number of generator processes.')
+    parser.add_argument(
+        '--seed', default=0, type=int,
+        help='Random seed, the same seed gives the same levels.')
+    parser.add_argument(
+        '--problem', default='zad2',
+        help='Problem name in the written test set.')
+    parser.add_argument(
+        '--timeout', default=10, type=float,
+        help='Timeout of the written test set, in seconds.')
+    parser.add_argument(
+        '--output', required=True,
+        help='YAML test set file to write.')
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_argparser().parse_args()
+    # Every level has its own seed, distinct for all (--seed, level) pairs.
+    params = [('%d-%d' % (args.seed, i), args.height, args.width, args.boxes,
+               args.wall_density, args.pulls, args.min_moves,
+               args.solver_memory, args.max_attempts)
+              for i in range(args.count)]
+    pool = multiprocessing.Pool(args.processes)
+    cases = []
+    try:
+        for case in pool.imap(generate_level, params):
+            cases.append(case)
+            print('Generated level %d/%d, %d moves.' % (
+                len(cases), args.count, case['out']))
+            sys.stdout.flush()
+    except validator.ValidatorException as e:
+        pool.terminate()
+        sys.exit(str(e))
+    pool.close()
+    pool.join()
+
+    testset = {args.problem: {
+        'defaults': {
+            'timeout': args.timeout,
+            'input_file': 'zad_input.txt',
+            'output_file': 'zad_output.txt',
+            },
+        'validator': 'sokoban_validator',
+        'cases': cases,
+        }}
+    with open(args.output, 'w') as testset_f:
+        validator.dump_testset(testset, testset_f)
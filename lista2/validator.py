@@ -24,6 +24,32 @@ Prosta sprawdzarka. Przykłady użycia:
 7. Ustawienie mnożnika dla limitów czasowych:
   `python validator.py --timeout-multiplier 2.5 zad1 python rozwiazanie.py`
 
+8. Kalibracja limitów czasowych rozwiązaniem wzorcowym:
+  `python validator.py --calibrate zad2 python wzorcowka.py`
+
+9. Zapisanie wyników w formacie JSON (jeden rekord na linię):
+  `python validator.py --json-out wyniki.jsonl zad2 python rozwiazanie.py`
+
+10. Zapisanie wyników w bazie SQLite i raport z historii ocen:
+  `python validator.py --history-db historia.db zad2 python rozwiazanie.py`
+  `python validator.py --history-db historia.db --history-report regressions zad2`
+
+11. Porównanie szybkości dwóch rozwiązań:
+  `python validator.py --compare zad2 python stare.py -- python nowe.py`
+
+12. Badanie złożoności rozwiązania na testach rosnącego rozmiaru:
+  `python validator.py --scaling --testset duze_testy.yaml zad2 python rozwiazanie.py`
+
+13. Sprawdzenie (lub wyznaczenie) limitów `out` rozwiązaniem wzorcowym:
+  `python validator.py --reference-solve check zad2`
+  `python validator.py --reference-solve fill --reference-output nowe.yaml --testset testy.yaml zad2`
+  `python validator.py --reference-solve check --solver-time 60 zad5`
+
+14. Sprawdzanie ruchów na bieżąco, w trakcie działania rozwiązania:
+  `python validator.py --stream zad2 python rozwiazanie.py`
+
+15. Sprawdzenie zapisanych odpowiedzi wielu rozwiązań naraz (`%d` to numer testu):
+  `python validator.py --batch-replay 'odpowiedzi/*/zad4_%d.txt' zad4`
 
 '''
 
@@ -32,10 +58,17 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import argparse
+import codecs
+import collections
+import glob
+import heapq
 import os
+import random
+import re
 import signal
 import subprocess
 import sys
+import tempfile
 import threading
 import time
 import math
@@ -45,8 +78,74 @@ import numpy as np
 
 import yaml
 
+# History, calibration, --compare and JSON helpers are shared by the
+# validators of all lists. They are loaded from this file only when one of
+# those options is used, so plain grading works with the validator alone.
+GRADING_FILE = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, 'grading.py'))
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
 VERBOSE = False
 
+
+# Streaming validation reads the output in chunks of this size and checks
+# the output file this often (in seconds).
+STREAM_CHUNK_SIZE = 65536
+STREAM_POLL_INTERVAL = 0.001
+
+# The reference solvers check memory use and report progress every that many
+# expanded states.
+SOLVER_CHECK_EVERY = 10000
+# Seed of the Zobrist keys, fixed to make the solvers deterministic.
+SOLVER_SEED = 1234
+# The Komandos solver gives up an exact search after that many expanded
+# beliefs and reduces the belief greedily instead. Searches retried after a
+# reduction get a tenth of that.
+SOLVER_EXACT_EXPANSIONS = 300000
+# Komandos beliefs are boolean grids in mazes with at least that many free
+# cells and sets of positions in smaller ones. On 2000 random moves sets are
+# faster below about 1000 cells (1.3 vs 9.8 ms at 58 cells) and grids above
+# (37 vs 23 ms at 2700 cells, 640 vs 57 ms at 45000 cells); all shipped
+# mazes are small.
+MAZE_BELIEF_MIN_CELLS = 1000
+# Batch replay moves the beliefs of all unfinished plans together, which
+# costs a few microseconds per step even for one plan. Plans that many times
+# longer than the median are replayed alone by belief_engine: on zad4 case 6
+# with 99 plans of 150 moves and one of 40000 the batch takes 0.27 s with
+# the long plan and 0.05 s without it (0.12 s for all plans one by one).
+BATCH_REPLAY_OUTLIER = 10
+
+# --scaling takes the time and memory of the smallest passing case, mostly
+# interpreter startup, as a baseline and fits the growth of the cases that
+# exceed it by at least the minimal excess. The largest size that fits in the
+# timeout is predicted only from a good fit (R^2 on the log-log scale) with
+# an exponent that is not near zero, and not far beyond the measured sizes.
+SCALING_MIN_EXCESS_TIME = 0.05  # s
+SCALING_MIN_EXCESS_MEMORY = 1.0  # MB
+SCALING_MIN_R2 = 0.9
+SCALING_MIN_EXPONENT = 0.2
+SCALING_MAX_EXTRAPOLATION = 100.0
+
+# Runs a shell command, then reports its wall time and the peak resident
+# memory of the largest single process among the command and its
+# descendants (ru_maxrss of RUSAGE_CHILDREN, in kilobytes on Linux). The
+# memory of processes running at the same time is not summed.
+PROFILE_WRAPPER = '''
+import resource, subprocess, sys, time
+start = time.time()
+status = subprocess.call(sys.argv[1], shell=True)
+with open(sys.argv[2], 'w') as stats_f:
+    stats_f.write('%f %d' % (
+        time.time() - start,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss))
+sys.exit(status if status >= 0 else 128 - status)
+'''
+
+
 # Tests embedded into the validator.
 DEFAULT_TESTSET_YAML = (
     u'''
@@ -1207,7 +1306,8 @@ class Sokoban(object):
                     yield m, (nl, b_locs)
                 else:  # maybe move BOX
                     nbl = (nl[0] + dr, nl[1] + dc)
-                    if empty_map[nbl[0], nbl[1]] <= Sokoban.GOAL:
+                    if (empty_map[nbl[0], nbl[1]] <= Sokoban.GOAL and
+                            nbl not in b_locs):
                         nb_locs = set(b_locs)
                         nb_locs.remove(nl)
                         nb_locs.add(nbl)
@@ -1229,23 +1329,336 @@ class Sokoban(object):
         return state
 
 
+class SokobanLevel(object):
+    """
+    Compact level representation shared by the replay and the solver. Cells
+    of the map padded with walls are numbered row by row, so that neighbours
+    are at fixed offsets, and sets of cells are Python ints used as bitsets.
+    """
+
+    def __init__(self, empty_map, state):
+        k_loc, b_locs = state
+        rows, cols = empty_map.shape
+        self.width = cols + 2
+        padded = np.full((rows + 2, cols + 2), Sokoban.WALL, dtype=np.uint8)
+        padded[1:-1, 1:-1] = empty_map
+        self.cells = padded.ravel()
+        self.offsets = {
+            m: dr * self.width + dc for m, (dr, dc) in Sokoban.MOVES.items()}
+        self.walls = self.to_bitset(np.flatnonzero(self.cells == Sokoban.WALL))
+        self.floor = self.to_bitset(np.flatnonzero(self.cells != Sokoban.WALL))
+        self.goals = self.to_bitset(np.flatnonzero(self.cells == Sokoban.GOAL))
+        self.keeper = self.index(k_loc)
+        self.boxes = self.to_bitset(self.index(b_loc) for b_loc in b_locs)
+        self.push_dist = self.find_push_distances()
+        self.dead = self.floor & ~self.to_bitset(
+            np.flatnonzero(self.push_dist < len(self.cells)))
+
+    @staticmethod
+    def from_lines(lines):
+        return SokobanLevel(*Sokoban.read_map(lines))
+
+    def index(self, loc):
+        return int((loc[0] + 1) * self.width + loc[1] + 1)
+
+    def loc(self, index):
+        return (index // self.width - 1, index % self.width - 1)
+
+    @staticmethod
+    def to_bitset(indices):
+        bits = 0
+        for i in indices:
+            bits |= 1 << int(i)
+        return bits
+
+    @staticmethod
+    def from_bitset(bits):
+        indices = []
+        while bits:
+            low = bits & -bits
+            indices.append(low.bit_length() - 1)
+            bits ^= low
+        return indices
+
+    def find_push_distances(self):
+        """
+        Smallest number of pushes that bring a box from each cell to a goal
+        when other boxes are ignored, found by pulling boxes away from the
+        goals. Cells from which no goal can be reached (dead squares: corners,
+        walls without goals, ...) get len(self.cells).
+        """
+        floor = self.cells != Sokoban.WALL
+        push_dist = np.full(len(self.cells), len(self.cells), dtype=np.int64)
+        queue = collections.deque(self.from_bitset(self.goals))
+        push_dist[queue] = 0
+        while queue:
+            i = queue.popleft()
+            for d in self.offsets.values():
+                # A box pushed in direction d from i - d needs the keeper
+                # at i - 2 * d.
+                if (floor[i - d] and floor[i - 2 * d] and
+                        push_dist[i - d] > push_dist[i] + 1):
+                    push_dist[i - d] = push_dist[i] + 1
+                    queue.append(i - d)
+        return push_dist
+
+    def walk_distances(self, start, boxes, targets):
+        """
+        Number of keeper moves from start to every reachable target cell,
+        found with a breadth-first search over bitsets.
+        """
+        free = self.floor & ~boxes
+        seen = frontier = 1 << start
+        distances = {}
+        dist = 0
+        width = self.width
+        while frontier and targets:
+            hit = frontier & targets
+            if hit:
+                for i in self.from_bitset(hit):
+                    distances[i] = dist
+                targets ^= hit
+            frontier = ((frontier << 1) | (frontier >> 1) |
+                        (frontier << width) | (frontier >> width))
+            frontier &= free & ~seen
+            seen |= frontier
+            dist += 1
+        return distances
+
+    def walk_path(self, start, target, boxes):
+        free = self.floor & ~boxes
+        parents = {start: None}
+        queue = collections.deque([start])
+        while queue:
+            i = queue.popleft()
+            if i == target:
+                break
+            for m, d in self.offsets.items():
+                if i + d not in parents and (free >> (i + d)) & 1:
+                    parents[i + d] = (i, m)
+                    queue.append(i + d)
+        path = []
+        while parents[target]:
+            target, m = parents[target]
+            path.append(m)
+        return ''.join(reversed(path))
+
+
+class ReferenceSolver(object):
+    """
+    Memory and time limits shared by the reference solvers.
+    """
+
+    def __init__(self, max_memory=None, progress=False, time_limit=None):
+        self.max_memory = max_memory
+        self.progress = progress
+        self.time_limit = time_limit
+        self.start_time = time.time()
+        self.num_expanded = 0
+
+    def check_limits(self, visited, bound):
+        if self.progress:
+            print('Expanded %d states, %d visited, bound %d' % (
+                self.num_expanded, len(visited), bound))
+            sys.stdout.flush()
+        if (self.max_memory and resource and
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss >
+                self.max_memory * 1024):
+            fail('Solver memory limit of %d MB exceeded after expanding '
+                 '%d states' % (self.max_memory, self.num_expanded))
+        if (self.time_limit and
+                time.time() - self.start_time > self.time_limit):
+            fail('Solver time limit of %f s exceeded after expanding '
+                 '%d states' % (self.time_limit, self.num_expanded))
+
+
+class SokobanSolver(ReferenceSolver):
+    """
+    Reference solver that finds a solution with the fewest keeper moves.
+
+    It runs A* over push states: the box set together with the keeper cell.
+    Successors are all pushes available in the keeper's region, each costing
+    the walk to the box plus one move. States are identified by Zobrist
+    hashes, boxes are never pushed onto dead squares and the heuristic is the
+    sum of push distances of the boxes to the nearest goals.
+    """
+
+    def __init__(self, level, max_memory=None, progress=False,
+                 time_limit=None):
+        ReferenceSolver.__init__(self, max_memory, progress, time_limit)
+        self.level = level
+        rng = random.Random(SOLVER_SEED)
+        self.box_keys = [rng.getrandbits(64) for _ in level.cells]
+        self.keeper_keys = [rng.getrandbits(64) for _ in level.cells]
+
+    def pushes(self, keeper, boxes):
+        level = self.level
+        free = level.floor & ~boxes
+        live = free & ~level.dead
+        candidates = []
+        targets = 0
+        for b in level.from_bitset(boxes):
+            for m, d in level.offsets.items():
+                if (live >> (b + d)) & 1 and (free >> (b - d)) & 1:
+                    candidates.append((b, m, d))
+                    targets |= 1 << (b - d)
+        distances = level.walk_distances(keeper, boxes, targets)
+        for b, m, d in candidates:
+            if b - d in distances:
+                yield b, m, d, distances[b - d]
+
+    def solve(self):
+        """
+        Returns the shortest move string, or None if the level is unsolvable.
+        """
+        level = self.level
+        push_dist = level.push_dist
+        keeper_keys, box_keys = self.keeper_keys, self.box_keys
+        start = keeper_keys[level.keeper]
+        for b in level.from_bitset(level.boxes):
+            start ^= box_keys[b]
+        start_h = int(sum(push_dist[b] for b in level.from_bitset(level.boxes)))
+        # Zobrist hash -> (moves, parent hash, pushed box, push move)
+        visited = {start: (0, None, None, None)}
+        # Entries: (moves + heuristic, -moves, keeper, boxes, hash, heuristic)
+        queue = [(start_h, 0, level.keeper, level.boxes, start, start_h)]
+        while queue:
+            f, g, keeper, boxes, state, h = heapq.heappop(queue)
+            g = -g
+            if visited[state][0] < g:
+                continue
+            if boxes == level.goals:
+                return self.reconstruct(visited, state)
+            self.num_expanded += 1
+            if self.num_expanded % SOLVER_CHECK_EVERY == 0:
+                self.check_limits(visited, f)
+            for b, m, d, walk in self.pushes(keeper, boxes):
+                n_g = g + walk + 1
+                n_state = (state ^ keeper_keys[keeper] ^ keeper_keys[b] ^
+                           box_keys[b] ^ box_keys[b + d])
+                if n_state in visited and visited[n_state][0] <= n_g:
+                    continue
+                visited[n_state] = (n_g, state, b, m)
+                n_h = int(h - push_dist[b] + push_dist[b + d])
+                heapq.heappush(queue, (
+                    n_g + n_h, -n_g, b, boxes ^ (1 << b) ^ (1 << (b + d)),
+                    n_state, n_h))
+        return None
+
+    def reconstruct(self, visited, state):
+        pushes = []
+        while visited[state][1] is not None:
+            _, state, b, m = visited[state]
+            pushes.append((b, m))
+        level = self.level
+        keeper, boxes = level.keeper, level.boxes
+        moves = []
+        for b, m in reversed(pushes):
+            d = level.offsets[m]
+            moves.append(level.walk_path(keeper, b - d, boxes) + m)
+            keeper, boxes = b, boxes ^ (1 << b) ^ (1 << (b + d))
+        return ''.join(moves)
+
+
+def solve_sokoban_case(case, max_memory=None, progress=False,
+                       time_limit=None):
+    level = SokobanLevel.from_lines(case['inp'].strip().split('\n'))
+    return SokobanSolver(level, max_memory, progress, time_limit).solve()
+
+
+class SokobanReplay(object):
+    """
+    Replays keeper moves on one mutable state: a flat array of level cells, in
+    which boxes are marked by adding Sokoban.BOX to the cell, so that every
+    move takes constant time. Box locations are also kept as a bitset, so that
+    the level is solved when it equals the goal bitset. Replay stops as soon
+    as a box is pushed onto a dead square, from which no goal can be reached.
+    """
+
+    def __init__(self, level):
+        self.level = level
+        self.cells = bytearray(level.cells.tobytes())
+        for b in level.from_bitset(level.boxes):
+            self.cells[b] += Sokoban.BOX
+        self.dead = bytearray(len(self.cells))
+        for i in level.from_bitset(level.dead):
+            self.dead[i] = 1
+        self.keeper = level.keeper
+        self.boxes = level.boxes
+        self.num_moves = 0
+
+    def replay(self, k_moves):
+        cells = self.cells
+        dead = self.dead
+        offsets = self.level.offsets
+        keeper = self.keeper
+        boxes = self.boxes
+        num_moves = self.num_moves
+        BOX, GOAL, WALL = Sokoban.BOX, Sokoban.GOAL, Sokoban.WALL
+        try:
+            for m in k_moves:
+                d = offsets[m]
+                nl = keeper + d
+                n = cells[nl]
+                if n == WALL:
+                    fail("Keeper move %s is illegal!" % (m,))
+                if n >= BOX:
+                    nbl = nl + d
+                    nb = cells[nbl]
+                    if nb > GOAL:
+                        fail("Keeper move %s is illegal!" % (m,))
+                    cells[nl] = n - BOX
+                    cells[nbl] = nb + BOX
+                    boxes ^= (1 << nl) | (1 << nbl)
+                    if dead[nbl]:
+                        keeper = nl
+                        num_moves += 1
+                        fail("Box pushed into deadlock at move %d" % (
+                            num_moves,))
+                keeper = nl
+                num_moves += 1
+        except KeyError as e:  # not a move character
+            fail("Keeper move %s is illegal!" % e.args)
+        finally:
+            self.keeper = keeper
+            self.boxes = boxes
+            self.num_moves = num_moves
+        return self
+
+    def solved(self):
+        return self.boxes == self.level.goals
+
+    def state(self):
+        level = self.level
+        return (level.loc(self.keeper),
+                frozenset(level.loc(b) for b in level.from_bitset(self.boxes)))
+
+
 def sokoban_validator(case, process_out, message=""):
     k_moves = whitespace_normalize(process_out)
     max_num_moves = int(whitespace_normalize(case['out']))
 
     empty_map, state = Sokoban.read_map(case['inp'].strip().split('\n'))
-    state = Sokoban.moves_to_strings(
-        empty_map, state, k_moves)
+    replay = SokobanReplay(SokobanLevel(empty_map, state))
+    if VERBOSE:
+        print(Sokoban.map_to_string(empty_map, state))
+        for m in k_moves:
+            replay.replay(m)
+            print("Keeper move %s" % (m,))
+            print(Sokoban.map_to_string(empty_map, replay.state()))
+    else:
+        replay.replay(k_moves)
+    return sokoban_verdict(replay, max_num_moves, message)
+
 
-    g_locs = set(zip(*(empty_map == Sokoban.GOAL).nonzero()))
-    solved = g_locs == state[1]
-    if solved:
-        if len(k_moves) > max_num_moves:
+def sokoban_verdict(replay, max_num_moves, message=""):
+    if replay.solved():
+        if replay.num_moves > max_num_moves:
             fail("Level solved, but path is too long!")
         else:
             if VERBOSE:
                 print(message + "Level solved!")
-            return {'num_steps': len(k_moves)}
+            return {'num_steps': replay.num_moves}
     else:
         fail("All moves were legal, but puzzle not solved")
 
@@ -1310,44 +1723,541 @@ class Maze:
         return {self.do(s, action) for s in states}
 
 
+class MazeSetBelief(object):
+    """
+    Belief engine that keeps the possible commando positions as a set, the
+    cost of a move grows with the number of positions.
+    """
+
+    def __init__(self, maze):
+        self.maze = maze
+
+    def to_set(self, belief):
+        return belief
+
+    def start(self):
+        return self.maze.starts
+
+    def do(self, belief, action):
+        return self.maze.do_belief(belief, action)
+
+    def solved_fraction(self, belief):
+        return len(belief & self.maze.goals) / len(belief)
+
+
+class MazeBelief(object):
+    """
+    Belief engine that keeps the set of possible commando positions as a
+    boolean grid, the cost of a move grows with the maze area. For every
+    action a mask of cells whose neighbour in that direction is free is
+    precomputed, so a move is one shifted-mask update.
+    """
+
+    def __init__(self, maze):
+        self.maze = maze
+        height = len(maze.m)
+        width = max(len(line) for line in maze.m)
+        self.free = np.zeros((height, width), dtype=bool)
+        for x, y in maze.states:
+            self.free[y, x] = True
+        self.goals = self.to_grid(maze.goals)
+        # Cells from which a move in the given direction succeeds.
+        self.movable = {}
+        for action, (dx, dy) in Maze._dirs.items():
+            movable = np.zeros_like(self.free)
+            movable[self.slice(dy, height), self.slice(dx, width)] = (
+                self.free[self.slice(-dy, height), self.slice(-dx, width)])
+            self.movable[action] = movable & self.free
+
+    @staticmethod
+    def slice(d, size):
+        """Cells whose neighbour at offset d is in range of 0..size-1."""
+        return slice(max(0, -d), size - max(0, d))
+
+    def to_grid(self, states):
+        grid = np.zeros_like(self.free)
+        for x, y in states:
+            grid[y, x] = True
+        return grid
+
+    def to_set(self, belief):
+        return {(int(x), int(y)) for y, x in zip(*belief.nonzero())}
+
+    def start(self):
+        return self.to_grid(self.maze.starts)
+
+    def do(self, belief, action):
+        dx, dy = Maze._dirs[action]
+        height, width = belief.shape
+        moving = belief & self.movable[action]
+        new_belief = belief & ~moving
+        new_belief[self.slice(-dy, height), self.slice(-dx, width)] |= (
+            moving[self.slice(dy, height), self.slice(dx, width)])
+        return new_belief
+
+    def solved_fraction(self, belief):
+        return (np.count_nonzero(belief & self.goals) /
+                np.count_nonzero(belief))
+
+
+def belief_engine(maze):
+    if len(maze.states) >= MAZE_BELIEF_MIN_CELLS:
+        return MazeBelief(maze)
+    return MazeSetBelief(maze)
+
+
+class CompiledMaze(object):
+    """
+    Maze compiled to transition tables: free cells are numbered 0..N-1 row by
+    row and next_state[action][i] is the cell reached from cell i. A belief
+    is a sorted array of distinct cell numbers, so it can be compared and
+    hashed through its bytes.
+    """
+
+    def __init__(self, maze):
+        self.maze = maze
+        cells = sorted(maze.states, key=lambda state: (state[1], state[0]))
+        self.cells = cells
+        self.number = {state: i for i, state in enumerate(cells)}
+        self.next_state = {}
+        for action in Maze._dirs:
+            self.next_state[action] = np.array(
+                [self.number[maze.do(state, action)] for state in cells],
+                dtype=np.int32)
+        # Rows of next_table follow self.actions, the extra last row keeps
+        # every cell in place and pads plans of different lengths.
+        self.actions = sorted(self.next_state)
+        self.next_table = np.stack(
+            [self.next_state[action] for action in self.actions] +
+            [np.arange(len(cells), dtype=np.int32)])
+        self.goals = np.zeros(len(cells), dtype=bool)
+        for state in maze.goals:
+            self.goals[self.number[state]] = True
+
+    def to_belief(self, states):
+        return np.unique(np.array(
+            [self.number[state] for state in states], dtype=np.int32))
+
+    def to_set(self, belief):
+        return {self.cells[i] for i in belief}
+
+    def start(self):
+        return self.to_belief(self.maze.starts)
+
+    def do(self, belief, action):
+        return np.unique(self.next_state[action][belief])
+
+    @staticmethod
+    def key(belief):
+        return belief.tobytes()
+
+    def solved_fraction(self, belief):
+        return np.count_nonzero(self.goals[belief]) / len(belief)
+
+    def replay_batch(self, plans):
+        """
+        Replays many plans at once. Beliefs are rows of a boolean matrix and
+        every step moves all of them with one indexing into next_table. The
+        rows are sorted by plan length and only those of unfinished plans
+        are moved; outliers, see BATCH_REPLAY_OUTLIER, are replayed alone.
+        Returns the solved fraction of each plan.
+        """
+        fractions = np.empty(len(plans))
+        max_length = BATCH_REPLAY_OUTLIER * max(
+            1, np.median([len(plan) for plan in plans] or [0]))
+        batched = []
+        for i, plan in enumerate(plans):
+            if len(plan) <= max_length:
+                batched.append(i)
+                continue
+            engine = belief_engine(self.maze)
+            belief = engine.start()
+            for action in plan:
+                belief = engine.do(belief, action)
+            fractions[i] = engine.solved_fraction(belief)
+        codes = {action: i for i, action in enumerate(self.actions)}
+        order = sorted(batched, key=lambda i: -len(plans[i]))
+        lengths = [len(plans[i]) for i in order]
+        beliefs = np.zeros((len(order), len(self.cells)), dtype=bool)
+        beliefs[:, self.start()] = True
+        # Between two distinct plan lengths the first num_active rows move.
+        start = 0
+        for num_active in range(len(order), 0, -1):
+            end = lengths[num_active - 1]
+            if end <= start:
+                continue
+            steps = np.array(
+                [[codes[action] for action in plans[i][start:end]]
+                 for i in order[:num_active]], dtype=np.int32)
+            active = beliefs[:num_active]
+            for t in range(end - start):
+                rows, cols = active.nonzero()
+                active = np.zeros_like(active)
+                active[rows, self.next_table[steps[rows, t], cols]] = True
+            beliefs[:num_active] = active
+            start = end
+        fractions[order] = ((beliefs & self.goals).sum(axis=1) /
+                            beliefs.sum(axis=1).astype(float))
+        return fractions
+
+
+class KomandosSolver(ReferenceSolver):
+    """
+    Reference solver of the Komandos belief problem. It first tries an A*
+    search from the start belief, using the largest goal distance of the
+    possible positions as the heuristic. When that takes too long, the
+    belief is reduced greedily: a breadth-first search finds the shortest
+    plan that makes it smaller, and A* is retried whenever the belief has
+    halved. The result is optimal only if the first search succeeds.
+    """
+
+    def __init__(self, maze, max_memory=None, progress=False,
+                 time_limit=None):
+        ReferenceSolver.__init__(self, max_memory, progress, time_limit)
+        self.maze = CompiledMaze(maze)
+        self.goal_dist = self.find_goal_distances()
+
+    def find_goal_distances(self):
+        """
+        Number of moves from each cell to the nearest goal, found by
+        relaxing all cells at once until nothing changes.
+        """
+        maze = self.maze
+        unreachable = len(maze.cells)
+        dist = np.where(maze.goals, 0, unreachable)
+        while True:
+            new_dist = dist
+            for next_state in maze.next_state.values():
+                new_dist = np.minimum(new_dist, dist[next_state] + 1)
+            if np.array_equal(new_dist, dist):
+                return dist
+            dist = new_dist
+
+    def heuristic(self, belief):
+        return int(self.goal_dist[belief].max())
+
+    def solved(self, belief):
+        return bool(self.maze.goals[belief].all())
+
+    def expand(self, belief):
+        for action in sorted(self.maze.next_state):
+            yield action, self.maze.do(belief, action)
+
+    def count_expansion(self, visited, bound):
+        self.num_expanded += 1
+        if self.num_expanded % SOLVER_CHECK_EVERY == 0:
+            self.check_limits(visited, bound)
+
+    def astar(self, start, max_expansions=None):
+        """
+        Shortest plan that brings every position of the start belief to a
+        goal. Returns None if there is none, False if the search was cut
+        after max_expansions.
+        """
+        key = CompiledMaze.key
+        start_h = self.heuristic(start)
+        if start_h >= len(self.maze.cells):
+            return None
+        visited = {key(start): (0, None, None)}
+        queue = [(start_h, 0, key(start), start)]
+        num_expanded = 0
+        while queue:
+            f, g, state, belief = heapq.heappop(queue)
+            g = -g
+            if visited[state][0] < g:
+                continue
+            if self.solved(belief):
+                return self.reconstruct(visited, state)
+            if max_expansions is not None and num_expanded >= max_expansions:
+                return False
+            num_expanded += 1
+            self.count_expansion(visited, f)
+            for action, n_belief in self.expand(belief):
+                n_state = key(n_belief)
+                n_g = g + 1
+                if n_state in visited and visited[n_state][0] <= n_g:
+                    continue
+                visited[n_state] = (n_g, state, action)
+                heapq.heappush(queue, (
+                    n_g + self.heuristic(n_belief), -n_g, n_state, n_belief))
+        return None
+
+    def reduce(self, start):
+        """
+        Shortest plan that makes the belief smaller, found with a
+        breadth-first search. Returns (plan, belief) or None.
+        """
+        key = CompiledMaze.key
+        visited = {key(start): (0, None, None)}
+        queue = collections.deque([start])
+        while queue:
+            belief = queue.popleft()
+            state = key(belief)
+            self.count_expansion(visited, len(start))
+            for action, n_belief in self.expand(belief):
+                n_state = key(n_belief)
+                if n_state in visited:
+                    continue
+                visited[n_state] = (0, state, action)
+                if len(n_belief) < len(start):
+                    return self.reconstruct(visited, n_state), n_belief
+                queue.append(n_belief)
+        return None
+
+    @staticmethod
+    def reconstruct(visited, state):
+        plan = []
+        while visited[state][1] is not None:
+            _, state, action = visited[state]
+            plan.append(action)
+        return ''.join(reversed(plan))
+
+    def solve(self):
+        """
+        Returns a move string, or None if the maze is unsolvable.
+        """
+        belief = self.maze.start()
+        prefix = []
+        max_expansions = SOLVER_EXACT_EXPANSIONS
+        while True:
+            plan = self.astar(belief, max_expansions)
+            if plan is None:
+                return None
+            if plan is not False:
+                return ''.join(prefix) + plan
+            last_size = len(belief)
+            while len(belief) > 1 and 2 * len(belief) > last_size:
+                reduction = self.reduce(belief)
+                if reduction is None:
+                    # No smaller belief is reachable, search exhaustively.
+                    max_expansions = None
+                    break
+                plan, belief = reduction
+                prefix.append(plan)
+                max_expansions = SOLVER_EXACT_EXPANSIONS // 10
+                if self.progress:
+                    print('Reduced the belief to %d positions in %d moves' % (
+                        len(belief), len(''.join(prefix))))
+                    sys.stdout.flush()
+            if len(belief) == 1:
+                max_expansions = None
+
+
+def solve_komandos_case(case, max_memory=None, progress=False,
+                        time_limit=None):
+    maze = Maze(case['inp'])
+    return KomandosSolver(maze, max_memory, progress, time_limit).solve()
+
+
+def check_komandos_moves(k_moves):
+    bad_moves = set(k_moves) - set(Maze._dirs)
+    if bad_moves:
+        fail("Unknown moves: %s" % (
+            ' '.join(sorted(repr(m) for m in bad_moves)),))
+
+
 def komandos_validator(case, process_out, message=""):
     k_moves = whitespace_normalize(process_out)
     max_num_moves = int(whitespace_normalize(case['out']))
+    check_komandos_moves(k_moves)
 
     maze = Maze(case['inp'])
+    engine = belief_engine(maze)
 
-    states = maze.starts
+    belief = engine.start()
 
     if VERBOSE:
-        print(maze.to_str(states))
+        print(maze.to_str(engine.to_set(belief)))
 
     for c in k_moves:
-        states = maze.do_belief(states, c)
+        belief = engine.do(belief, c)
         if VERBOSE:
-            print(maze.to_str(states))
+            print(maze.to_str(engine.to_set(belief)))
 
-    solved_fraction = len(states & maze.goals) / len(states)
+    return komandos_verdict(
+        engine.solved_fraction(belief), len(k_moves), max_num_moves, message)
 
+
+def komandos_verdict(solved_fraction, num_moves, max_num_moves, message=""):
     if solved_fraction == 1:
-        if len(k_moves) > max_num_moves:
+        if num_moves > max_num_moves:
             fail(message + "Level solved, but path is too long!")
         else:
             if VERBOSE:
                 print("Level solved!")
-            return {'num_moves': len(k_moves)}
+            return {'num_moves': num_moves}
     else:
         fail("%sLevel solved in %f%% only!" % (
              message, solved_fraction * 100.0))
 
 
+# Batch validation
+
+def batch_sokoban_validator(case, process_outs):
+    max_num_moves = int(whitespace_normalize(case['out']))
+    level = SokobanLevel.from_lines(case['inp'].strip().split('\n'))
+    verdicts = []
+    for process_out in process_outs:
+        try:
+            replay = SokobanReplay(level).replay(
+                whitespace_normalize(process_out))
+            verdicts.append((sokoban_verdict(replay, max_num_moves), None))
+        except ValidatorException as e:
+            verdicts.append((None, str(e)))
+    return verdicts
+
+
+def batch_komandos_validator(case, process_outs):
+    max_num_moves = int(whitespace_normalize(case['out']))
+    maze = CompiledMaze(Maze(case['inp']))
+    verdicts = [None] * len(process_outs)
+    plans = []
+    for i, process_out in enumerate(process_outs):
+        k_moves = whitespace_normalize(process_out)
+        try:
+            check_komandos_moves(k_moves)
+        except ValidatorException as e:
+            verdicts[i] = (None, str(e))
+        else:
+            plans.append((i, k_moves))
+    fractions = maze.replay_batch([k_moves for _, k_moves in plans])
+    for (i, k_moves), solved_fraction in zip(plans, fractions):
+        try:
+            verdicts[i] = (komandos_verdict(
+                solved_fraction, len(k_moves), max_num_moves), None)
+        except ValidatorException as e:
+            verdicts[i] = (None, str(e))
+    return verdicts
+
+
+# Validators that check many outputs of one case together, returning a
+# (measurements, error message) pair per output.
+BATCH_VALIDATORS = {
+    'sokoban_validator': batch_sokoban_validator,
+    'komandos_validator': batch_komandos_validator,
+    }
+
+
+def batch_validate(problem_def, problem_cases, pattern):
+    """
+    Validate saved outputs of many solutions. For every case the outputs are
+    the files matching `pattern` with the case number substituted for %d.
+    """
+    if problem_def['validator'] not in BATCH_VALIDATORS:
+        fail('No batch validator for %s' % (problem_def['validator'],))
+    validator = BATCH_VALIDATORS[problem_def['validator']]
+    for case_num, case_def in problem_cases:
+        paths = sorted(glob.glob(pattern % (case_num,)))
+        process_outs = []
+        for path in paths:
+            with open(path, 'rb') as out_f:
+                process_outs.append(out_f.read().decode('utf8'))
+        start = time.time()
+        verdicts = validator(case_def, process_outs)
+        ok = 0
+        for path, (_, error) in zip(paths, verdicts):
+            if error is None:
+                ok += 1
+            else:
+                print('%s: %s' % (path, error))
+        print('Case %d: %d/%d outputs pass, checked in %f s.' % (
+            case_num, ok, len(paths), time.time() - start))
+        sys.stdout.flush()
+
+
+# Streaming validation
+
+class MoveStream(object):
+    """
+    Validates moves while the solution is still writing them. The text is
+    normalized like in the validators, subclasses replay the moves in
+    apply() and give the final verdict in finish().
+    """
+
+    def __init__(self, case):
+        self.max_num_moves = int(whitespace_normalize(case['out']))
+        self.num_moves = 0
+        self.normalizer = WhitespaceNormalizer()
+
+    def feed(self, text):
+        moves = self.normalizer.feed(text)
+        allowed = self.max_num_moves - self.num_moves
+        self.apply(moves[:allowed])
+        self.num_moves += min(len(moves), allowed)
+        if len(moves) > allowed:
+            fail("Path is too long, more than %d moves!" % (
+                self.max_num_moves,))
+
+
+class SokobanStream(MoveStream):
+    def __init__(self, case):
+        MoveStream.__init__(self, case)
+        self.replay = SokobanReplay(
+            SokobanLevel.from_lines(case['inp'].strip().split('\n')))
+
+    def apply(self, moves):
+        self.replay.replay(moves)
+
+    def finish(self):
+        return sokoban_verdict(self.replay, self.max_num_moves)
+
+
+class KomandosStream(MoveStream):
+    def __init__(self, case):
+        MoveStream.__init__(self, case)
+        self.engine = belief_engine(Maze(case['inp']))
+        self.belief = self.engine.start()
+
+    def apply(self, moves):
+        check_komandos_moves(moves)
+        for c in moves:
+            self.belief = self.engine.do(self.belief, c)
+
+    def finish(self):
+        return komandos_verdict(
+            self.engine.solved_fraction(self.belief), self.num_moves,
+            self.max_num_moves)
+
+
+STREAM_VALIDATORS = {
+    'sokoban_validator': SokobanStream,
+    'komandos_validator': KomandosStream,
+    }
+
+
 # Comparison functions
 
 class ValidatorException(Exception):
-    pass
+    """
+    A failed case. `measurements` keeps what was measured before it failed,
+    e.g. the run time, for the JSON and history records.
+    """
+
+    def __init__(self, message, measurements=None):
+        Exception.__init__(self, message)
+        self.measurements = dict(measurements or {})
 
 
-def fail(message):
-    raise ValidatorException(message)
+def fail(message, measurements=None):
+    raise ValidatorException(message, measurements)
+
+
+def load_grading():
+    """
+    Load GRADING_FILE by path, without putting its directory on sys.path.
+    Returns None if the validator was copied out of the repository.
+    """
+    if not os.path.isfile(GRADING_FILE):
+        return None
+    try:
+        from importlib.util import module_from_spec, spec_from_file_location
+    except ImportError:  # py2
+        import imp
+        return imp.load_source('grading', GRADING_FILE)
+    spec = spec_from_file_location('grading', GRADING_FILE)
+    grading = module_from_spec(spec)
+    spec.loader.exec_module(grading)
+    return grading
 
 
 def compare(returned, expected, message="Contents"):
@@ -1406,6 +2316,36 @@ def whitespace_normalize(obj):
     return '\n'.join(lines)
 
 
+WHITESPACE_RE = re.compile(r'(\s+)', re.UNICODE)
+
+
+class WhitespaceNormalizer(object):
+    """
+    Incremental whitespace_normalize: leading and trailing whitespace is
+    dropped, inner whitespace becomes its newlines or, if it has none, a
+    single space.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.pending = ''
+
+    def feed(self, text):
+        normalized = []
+        for part in WHITESPACE_RE.split(text.replace('\r', '')):
+            if not part:
+                continue
+            if part.isspace():
+                self.pending += part
+                continue
+            if self.started and self.pending:
+                normalized.append('\n' * self.pending.count('\n') or ' ')
+            self.pending = ''
+            self.started = True
+            normalized.append(part)
+        return ''.join(normalized)
+
+
 # Subprocess handling utils
 try:  # py3
     from shlex import quote as shellquote
@@ -1428,15 +2368,37 @@ else:
             os.killpg(os.getpgid(process.pid), signal.SIGTERM)
 
 
-def run_and_score_case(program, defaults, case_def, validator, timeout_multiplier):
+def run_and_score_case(program, defaults, case_def, validator, timeout_multiplier,
+                       phases=None, stream=None):
+    if phases is None:
+        phases = {}
     opts = dict(defaults)
     opts.update(case_def)
     opts['timeout'] *= timeout_multiplier
-    process_out, elapsed_time = run_case(program, **opts)
+    start = time.time()
+    try:
+        if stream:
+            case_stream = stream(opts)
+            process_out, elapsed_time = run_case_streaming(
+                program, case_stream, **opts)
+        else:
+            process_out, elapsed_time = run_case(program, **opts)
+    finally:
+        phases['run'] = time.time() - start
     if VERBOSE:
         print("Got output:")
         print(process_out)
-    measurements = validator(opts, process_out)
+    start = time.time()
+    try:
+        if stream:
+            measurements = case_stream.finish()
+        else:
+            measurements = validator(opts, process_out)
+    except ValidatorException as e:
+        e.measurements['time'] = elapsed_time
+        raise
+    finally:
+        phases['validate'] = time.time() - start
     measurements = measurements or {}
     measurements['time'] = elapsed_time
     return measurements
@@ -1444,8 +2406,8 @@ def run_and_score_case(program, defaults, case_def, validator, timeout_multiplie
 
 def run_case(program, inp, out=None,
              input_file='<stdin>', output_file='<stdout>',
-             timeout=1.0):
-    del out  # unused
+             timeout=1.0, **case_info):
+    del out, case_info  # unused
     inp = ensure_unicode(inp)
     if inp[-1] != '\n':
         inp += '\n'
@@ -1489,11 +2451,13 @@ def run_case(program, inp, out=None,
         if timeout > 0:
             timer.cancel()
     if process.poll() != 0:
-        fail("Bad process exit status: %d" % (process.poll(),))
+        fail("Bad process exit status: %d" % (process.poll(),),
+             {'time': elapsed})
 
     if output_file != '<stdout>':
         if not os.path.isfile(output_file):
-            fail("Output file %s does not exist" % (output_file, ))
+            fail("Output file %s does not exist" % (output_file, ),
+                 {'time': elapsed})
         with open(output_file, 'rb') as out_f:
             process_out = out_f.read()
     process_out = process_out.decode('utf8')
@@ -1501,6 +2465,104 @@ def run_case(program, inp, out=None,
     return process_out, elapsed
 
 
+def write_input(stdin_f, inp):
+    try:
+        stdin_f.write(inp)
+        stdin_f.close()
+    except (IOError, OSError):  # the program exited without reading it
+        pass
+
+
+def run_case_streaming(program, stream, inp, out=None,
+                       input_file='<stdin>', output_file='<stdout>',
+                       timeout=1.0, **case_info):
+    """
+    Like run_case, but the output is fed to `stream` as soon as it appears
+    and the program is killed when the stream fails.
+    """
+    del out, case_info  # unused
+    inp = ensure_unicode(inp)
+    if inp[-1] != '\n':
+        inp += '\n'
+    inp = inp.encode('utf8')
+
+    if input_file != '<stdin>':
+        with open(input_file, 'wb') as in_f:
+            in_f.write(inp)
+        inp = None
+    try:
+        if output_file != '<stdout>':
+            os.remove(output_file)
+    except:
+        pass
+
+    stdin = subprocess.PIPE if input_file == '<stdin>' else None
+    stdout = subprocess.PIPE if output_file == '<stdout>' else None
+    decoder = codecs.getincrementaldecoder('utf8')()
+    chunks = []
+    process = None
+    out_f = None
+
+    try:
+        if os.name == 'nt':
+            kwargs = {}
+        else:
+            kwargs = {'preexec_fn': os.setpgrp}
+
+        process = subprocess.Popen(
+            program, shell=True, stdin=stdin, stdout=stdout, **kwargs)
+        start = time.time()
+        if timeout > 0:
+            timer = threading.Timer(timeout, kill_proc, [process])
+            timer.start()
+        if inp is not None:
+            threading.Thread(
+                target=write_input, args=(process.stdin, inp)).start()
+
+        while True:
+            if stdout:
+                data = os.read(process.stdout.fileno(), STREAM_CHUNK_SIZE)
+                running = bool(data)
+            else:
+                running = process.poll() is None
+                if out_f is None and os.path.isfile(output_file):
+                    out_f = open(output_file, 'rb')
+                data = out_f.read() if out_f else b''
+                if running and not data:
+                    time.sleep(STREAM_POLL_INTERVAL)
+            if data:
+                chunks.append(data)
+                stream.feed(decoder.decode(data))
+            elif not running:
+                break
+        stream.feed(decoder.decode(b'', True))
+        process.wait()
+        elapsed = time.time() - start
+    except ValidatorException as e:
+        # The stream failed, the program was stopped early.
+        e.measurements['time'] = time.time() - start
+        raise
+    except Exception as e:
+        fail(str(e))
+    finally:
+        if process:
+            kill_proc(process)
+        if timeout > 0:
+            timer.cancel()
+        if out_f:
+            out_f.close()
+    if process.poll() != 0:
+        fail("Bad process exit status: %d" % (process.poll(),),
+             {'time': elapsed})
+
+    if output_file != '<stdout>' and out_f is None:
+        fail("Output file %s does not exist" % (output_file, ),
+             {'time': elapsed})
+    process_out = b''.join(chunks).decode('utf8')
+
+    return process_out, elapsed
+
+
 def ensure_newline_string(obj):
     obj = ensure_unicode(obj)
     if obj[-1] != '\n':
@@ -1531,6 +2593,69 @@ def get_argparser():
     parser.add_argument(
         '--timeout-multiplier', '-tm',
         help='Multiply timeout by provided amount, e.g. 2.13')
+    parser.add_argument(
+        '--calibrate', default=False, action='store_true',
+        help='Run the program as the reference solution and store per-case '
+             'timeout scales for this machine.')
+    parser.add_argument(
+        '--calibration-file', default='.calibration_result',
+        help='File with per-case timeout scales.')
+    parser.add_argument(
+        '--calibration-repeats', default=3, type=int,
+        help='Number of reference runs per case during calibration.')
+    parser.add_argument(
+        '--json-out', default='',
+        help='Stream JSON records with per-case results to this file.')
+    parser.add_argument(
+        '--history-db', default='',
+        help='SQLite file in which results of every case are recorded.')
+    parser.add_argument(
+        '--history-report', choices=['slowest', 'trend', 'regressions'],
+        help='Print a report from --history-db instead of running cases.')
+    parser.add_argument(
+        '--history-solution', default='',
+        help='Limit the history report to solution hashes with this prefix.')
+    parser.add_argument(
+        '--history-threshold', default=10.0, type=float,
+        help='Slowdown, in percent, reported as a regression.')
+    parser.add_argument(
+        '--history-order', default=False, action='store_true',
+        help='Run the cases that failed most often or took longest first.')
+    parser.add_argument(
+        '--compare', default=False, action='store_true',
+        help='Compare the speed of two programs given as PROG_A -- PROG_B.')
+    parser.add_argument(
+        '--compare-repeats', default=5, type=int,
+        help='Number of runs of each program per case in --compare mode.')
+    parser.add_argument(
+        '--scaling', default=False, action='store_true',
+        help='Run cases in the order of increasing size and estimate how '
+             'time and memory grow with it.')
+    parser.add_argument(
+        '--reference-solve', choices=['check', 'fill'],
+        help='Solve the cases with the reference solver and check or fill in '
+             'their out bounds.')
+    parser.add_argument(
+        '--reference-output', default='',
+        help='Test set file written by --reference-solve fill.')
+    parser.add_argument(
+        '--solver-memory', default=4096, type=int,
+        help='Memory limit of the reference solver in MB.')
+    parser.add_argument(
+        '--solver-time', default=None, type=float,
+        help='Time limit of the reference solver per case, in seconds.')
+    parser.add_argument(
+        '--solver-progress', default=False, action='store_true',
+        help='Report the progress of the reference solver.')
+    parser.add_argument(
+        '--batch-replay', default='', metavar='PATTERN',
+        help='Validate saved outputs of many solutions instead of running a '
+             'program. PATTERN is a glob in which %%d stands for the case '
+             'number.')
+    parser.add_argument(
+        '--stream', default=False, action='store_true',
+        help='Validate moves while the program is still writing them and '
+             'stop it at the first wrong one.')
     parser.add_argument(
         '--verbose', default=False, action='store_true',
         help='Print more information about solutions.')
@@ -1574,6 +2699,190 @@ def get_cases(problem_def, cases):
                 yield case + 1, problem_cases[case]
 
 
+def get_case_size(validator_name, case):
+    """
+    Size of a case: its `size` tag, or the number of boxes for Sokoban, the
+    maze area for Komandos and the grid area for nonograms.
+    """
+    if 'size' in case:
+        return case['size']
+    lines = [l.strip() for l in ensure_unicode(case['inp']).split('\n')
+             if l.strip()]
+    if validator_name == 'sokoban_validator':
+        return sum(l.count('B') + l.count('*') for l in lines)
+    if validator_name == 'komandos_validator':
+        return sum(len(l) - l.count('#') for l in lines)
+    rows, cols = lines[0].split()[:2]
+    return int(rows) * int(cols)
+
+
+def profile_case(program, defaults, case_def, validator, timeout_multiplier):
+    stats_fd, stats_file = tempfile.mkstemp(prefix='profile_', suffix='.txt')
+    os.close(stats_fd)
+    try:
+        measurements = run_and_score_case(
+            ' '.join([shellquote(a) for a in [
+                sys.executable, '-c', PROFILE_WRAPPER, program, stats_file]]),
+            defaults, case_def, validator, timeout_multiplier)
+        with open(stats_file) as stats_f:
+            elapsed, maxrss = stats_f.read().split()
+    finally:
+        os.remove(stats_file)
+    measurements['time'] = float(elapsed)
+    measurements['memory'] = int(maxrss) / 1024.0
+    return measurements
+
+
+def fit_power_law(sizes, values, min_excess):
+    """
+    Least-squares fit of `values = baseline + coef * sizes ** exponent` on a
+    log-log scale, with the smallest value as the baseline. Only values at
+    least min_excess above the baseline are fitted. Returns (baseline,
+    exponent, coef, r2), or None if they have fewer than two sizes.
+    """
+    sizes = np.asarray(sizes, dtype=float)
+    values = np.asarray(values, dtype=float)
+    baseline = values.min()
+    fitted = values - baseline >= min_excess
+    if len(set(sizes[fitted])) < 2:
+        return None
+    log_sizes = np.log(sizes[fitted])
+    log_values = np.log(values[fitted] - baseline)
+    exponent, log_coef = np.polyfit(log_sizes, log_values, 1)
+    residual = ((log_values - exponent * log_sizes - log_coef) ** 2).sum()
+    total = ((log_values - log_values.mean()) ** 2).sum()
+    r2 = 1.0 - residual / total if total > 0 else 1.0
+    return baseline, exponent, np.exp(log_coef), r2
+
+
+def profile_scaling(program, problem_def, problem_cases, validator,
+                    get_timeout_multiplier):
+    """
+    Run the cases in the order of increasing size and fit time and memory
+    above their baselines against size, see SCALING_MIN_EXCESS_TIME. Memory
+    is the peak of the largest single process, see PROFILE_WRAPPER. The
+    predicted largest size is checked against the effective timeout (with
+    --timeout-multiplier and calibration) of the largest passing case.
+    """
+    validator_name = problem_def['validator']
+    cases = sorted(problem_cases,
+                   key=lambda case: get_case_size(validator_name, case[1]))
+    sizes, times, memories = [], [], []
+    timeout = None
+    for case_num, case_def in cases:
+        size = get_case_size(validator_name, case_def)
+        print('Running case %d (size %s)... ' % (case_num, size), end='')
+        sys.stdout.flush()
+        try:
+            meas = profile_case(
+                program, problem_def['defaults'], case_def, validator,
+                get_timeout_multiplier(case_num))
+        except ValidatorException as e:
+            print('Failed:')
+            print(str(e))
+            continue
+        print('time %f s, memory %.1f MB' % (meas['time'], meas['memory']))
+        timeout = (dict(problem_def['defaults'], **case_def)['timeout'] *
+                   get_timeout_multiplier(case_num))
+        timeout_case = case_num
+        sizes.append(size)
+        times.append(meas['time'])
+        memories.append(meas['memory'])
+
+    if len(set(sizes)) < 2:
+        print('\nAt least two passing cases of different sizes are needed.')
+        return
+    print()
+    time_fit = fit_power_law(sizes, times, SCALING_MIN_EXCESS_TIME)
+    mem_fit = fit_power_law(sizes, memories, SCALING_MIN_EXCESS_MEMORY)
+    for name, unit, fit in (('Time', 's', time_fit),
+                            ('Memory', 'MB', mem_fit)):
+        if fit is None:
+            print('%s barely grows above the smallest case, no fit.' % (
+                name,))
+        else:
+            print('%s above a baseline of %.3g %s grows as size^%.2f '
+                  '(R^2 %.2f).' % (name, fit[0], unit, fit[1], fit[3]))
+    if time_fit is None:
+        return
+    baseline, time_exp, time_coef, r2 = time_fit
+    if r2 < SCALING_MIN_R2 or time_exp < SCALING_MIN_EXPONENT:
+        print('The time fit is too poor or too flat to predict the largest '
+              'size.')
+        return
+    if timeout <= baseline:
+        print('The baseline time exceeds the %s s timeout of case %d.' % (
+            timeout, timeout_case))
+        return
+    largest = ((timeout - baseline) / time_coef) ** (1.0 / time_exp)
+    if largest > SCALING_MAX_EXTRAPOLATION * max(sizes):
+        print('Largest size that fits in the %s s timeout of case %d is more '
+              'than %g times the largest measured size.' % (
+                  timeout, timeout_case, SCALING_MAX_EXTRAPOLATION))
+        return
+    print('Largest size that fits in the %s s timeout of case %d: %.0f' % (
+        timeout, timeout_case, largest))
+
+
+REFERENCE_SOLVERS = {
+    'komandos_validator': solve_komandos_case,
+    'sokoban_validator': solve_sokoban_case,
+    }
+
+
+def solve_bounds(problem_def, problem_cases, mode, max_memory, progress,
+                 time_limit=None):
+    """
+    Solve the cases with the reference solver. In the `check` mode report if
+    the `out` bound is not reached, in the `fill` mode set `out` to the
+    length of the reference solution.
+    """
+    if problem_def['validator'] not in REFERENCE_SOLVERS:
+        fail('No reference solver for %s' % (problem_def['validator'],))
+    solve_case = REFERENCE_SOLVERS[problem_def['validator']]
+    validator = eval(problem_def['validator'])
+    for case_num, case_def in problem_cases:
+        print('Solving case %d... ' % (case_num,))
+        sys.stdout.flush()
+        start = time.time()
+        try:
+            solution = solve_case(case_def, max_memory, progress, time_limit)
+        except ValidatorException as e:
+            print('Failed:')
+            print(str(e))
+            continue
+        if solution is None:
+            print('Case %d has no solution!' % (case_num,))
+            continue
+        validator(dict(case_def, out=len(solution)), solution)
+        print('Case %d: %d moves in %f s, out: %s' % (
+            case_num, len(solution), time.time() - start,
+            case_def.get('out')))
+        if mode == 'fill':
+            case_def['out'] = len(solution)
+        elif len(solution) > int(case_def['out']):
+            print('The bound is not reached by the reference solution!')
+
+
+class TestsetDumper(yaml.SafeDumper):
+    """
+    Dumps multi-line strings, e.g. maps, as literal blocks.
+    """
+
+
+def represent_text(dumper, data):
+    return dumper.represent_scalar(
+        'tag:yaml.org,2002:str', data, style='|' if '\n' in data else None)
+
+
+TestsetDumper.add_representer(type(''), represent_text)
+
+
+def dump_testset(testset, testset_f):
+    yaml.dump(testset, testset_f, Dumper=TestsetDumper,
+              default_flow_style=False, allow_unicode=True)
+
+
 def simple_benchmark():
     product = 1.0
     for counter in range(1, 1000, 1):
@@ -1626,29 +2935,165 @@ if __name__ == '__main__':
     problem_def = testset[args.problem]
     problem_validator = eval(problem_def['validator'])
     problem_cases = get_cases(problem_def, args.cases)
+    testset_key = args.testset or 'default'
+
+    grading = None
+    if (args.history_db or args.calibrate or args.compare or
+            args.json_out or os.path.isfile(args.calibration_file)):
+        grading = load_grading()
+        if grading is None:
+            parser.error(
+                '%s not found. --history-db, --calibrate, --compare, '
+                '--json-out and the calibration file %s need it, run the '
+                'validator from the repository.' % (
+                    GRADING_FILE, args.calibration_file))
+
+    stream = None
+    if args.stream:
+        if problem_def['validator'] not in STREAM_VALIDATORS:
+            parser.error('--stream is not supported for %s' % (
+                problem_def['validator'],))
+        stream = STREAM_VALIDATORS[problem_def['validator']]
+
+    history = None
+    if args.history_db:
+        history = grading.GradingHistory(args.history_db)
+    if args.history_report:
+        if not history:
+            parser.error('--history-report requires --history-db')
+        grading.print_history_report(
+            history, args.history_report, testset_key, args.problem,
+            args.history_solution, args.history_threshold)
+        sys.exit()
+
+    if args.reference_solve:
+        if args.reference_solve == 'fill' and not args.reference_output:
+            parser.error('--reference-solve fill requires --reference-output')
+        solve_bounds(problem_def, problem_cases, args.reference_solve,
+                     args.solver_memory, args.solver_progress,
+                     args.solver_time)
+        if args.reference_solve == 'fill':
+            with open(args.reference_output, 'w') as testset_f:
+                dump_testset(testset, testset_f)
+        sys.exit()
+
+    if args.batch_replay:
+        batch_validate(problem_def, problem_cases, args.batch_replay)
+        sys.exit()
+
     program = get_program(args.program)
 
     if args.show_example:
         show_example(problem_def['defaults'], next(problem_cases)[1])
         sys.exit()
 
+    if args.stdio:
+        problem_def['defaults']['input_file'] = '<stdin>'
+        problem_def['defaults']['output_file'] = '<stdout>'
+
+    calibration = {}
+    if grading:
+        calibration = grading.load_calibration(args.calibration_file)
+
+    def get_case_scale(case_num):
+        if grading is None:
+            return benchmark_result
+        return grading.get_case_scale(
+            calibration, testset_key, args.problem, case_num,
+            benchmark_result)
+
+    if args.calibrate:
+        factors = grading.calibrate_cases(
+            run_and_score_case, ValidatorException, program,
+            problem_def['defaults'], problem_cases, problem_validator,
+            args.calibration_repeats)
+        calibration.setdefault(testset_key, {}).setdefault(
+            args.problem, {}).update(factors)
+        with open(args.calibration_file, 'w') as calibration_f:
+            yaml.safe_dump(calibration, calibration_f,
+                           default_flow_style=False)
+        print('\nCalibrated %d cases, results saved in %s.' % (
+            len(factors), args.calibration_file))
+        sys.exit()
+
+    if args.compare:
+        if '--' not in args.program:
+            parser.error('--compare expects PROG_A -- PROG_B')
+        split = args.program.index('--')
+        programs = [get_program(args.program[:split]),
+                    get_program(args.program[split + 1:])]
+        timeout_multiplier = float(args.timeout_multiplier) if args.timeout_multiplier and float(args.timeout_multiplier) > 1 else 1
+        grading.compare_programs(
+            run_and_score_case, ValidatorException, programs,
+            problem_def['defaults'], problem_cases, problem_validator,
+            lambda case_num: timeout_multiplier * get_case_scale(case_num),
+            args.compare_repeats)
+        sys.exit()
+
+    if args.scaling:
+        timeout_multiplier = float(args.timeout_multiplier) if args.timeout_multiplier and float(args.timeout_multiplier) > 1 else 1
+        profile_scaling(
+            program, problem_def, problem_cases, problem_validator,
+            lambda case_num: timeout_multiplier * get_case_scale(case_num))
+        sys.exit()
+
+    host = solution = None
+    if grading:
+        host = grading.get_host_fingerprint()
+        host['benchmark'] = benchmark_result
+        solution = grading.get_solution_hash(args.program)
+    json_out = None
+    if args.json_out:
+        json_out = open(args.json_out, 'w')
+    if history:
+        history.start_run(solution, program, testset_key, args.problem, host)
+        if args.history_order:
+            problem_cases = list(problem_cases)
+            case_order = history.case_order(
+                testset_key, args.problem,
+                [case_num for case_num, _ in problem_cases])
+            problem_cases = sorted(
+                problem_cases,
+                key=lambda case: case_order.index(case[0]))
+
     failed_cases = []
     ok_cases = []
+    t_start = time.time()
     for case_num, case_def in problem_cases:
         print('Running case %d... ' % (case_num,), end='')
+        case_scale = get_case_scale(case_num)
+        case_meas, case_phases, message = {}, {}, None
         try:
             timeout_multiplier = float(args.timeout_multiplier) if args.timeout_multiplier and float(args.timeout_multiplier) > 1 else 1
             if args.stdio:
                 case_def['input_file'] = '<stdin>'
                 case_def['output_file'] = '<stdout>'
             case_meas = run_and_score_case(
-                program, problem_def['defaults'], case_def, problem_validator, timeout_multiplier*benchmark_result)
+                program, problem_def['defaults'], case_def, problem_validator, timeout_multiplier*case_scale,
+                phases=case_phases, stream=stream)
             ok_cases.append((case_num, case_meas))
             print('OK!')
         except ValidatorException as e:
+            message = str(e)
+            case_meas = e.measurements
             failed_cases.append(case_num)
             print('Failed:')
-            print(str(e))
+            print(message)
+        if json_out:
+            grading.write_json_record(json_out, {
+                'type': 'case',
+                'problem': args.problem,
+                'case': case_num,
+                'status': 'failed' if message is not None else 'ok',
+                'message': message,
+                'measurements': case_meas,
+                'phases': case_phases,
+                'timeout_scale': case_scale,
+                'host': host,
+                'solution': solution,
+                })
+        if history:
+            history.add_result(case_num, message, case_meas)
 
     print('\nValidation result: %d/%d cases pass.\n' % (
         len(ok_cases), len(ok_cases) + len(failed_cases)))
@@ -1660,6 +3105,20 @@ if __name__ == '__main__':
     for k, v in tot_meas.items():
         print("For passing cases total %s: %s" % (k, v))
 
+    if json_out:
+        grading.write_json_record(json_out, {
+            'type': 'summary',
+            'problem': args.problem,
+            'passed': len(ok_cases),
+            'total': len(ok_cases) + len(failed_cases),
+            'failed_cases': failed_cases,
+            'totals': tot_meas,
+            'eval_time': time.time() - t_start,
+            'host': host,
+            'solution': solution,
+            })
+        json_out.close()
+
     if failed_cases:
         print('\nSome test cases have failed. '
               'To rerun the failing cases execute:')
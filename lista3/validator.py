@@ -24,6 +24,32 @@ Prosta sprawdzarka. Przykłady użycia:
 7. Ustawienie mnożnika dla limitów czasowych:
   `python validator.py --timeout-multiplier 2.5 zad1 python rozwiazanie.py`
 
+8. Kalibracja limitów czasowych rozwiązaniem wzorcowym:
+  `python validator.py --calibrate zad4 python wzorcowka.py`
+
+9. Zapisanie wyników w formacie JSON (jeden rekord na linię):
+  `python validator.py --json-out wyniki.jsonl zad4 python rozwiazanie.py`
+
+10. Zapisanie wyników w bazie SQLite i raport z historii ocen:
+  `python validator.py --history-db historia.db zad4 python rozwiazanie.py`
+  `python validator.py --history-db historia.db --history-report regressions zad4`
+
+11. Porównanie szybkości dwóch rozwiązań:
+  `python validator.py --compare zad4 python stare.py -- python nowe.py`
+
+12. Wybór sposobu uruchamiania SWI-Prologu (domyślnie `subprocess`, czyli
+    osobny proces `swipl` dla każdego programu; `pool` używa stale
+    działających procesów `swipl`, jeśli poprawnie wykonają program testowy):
+  `python validator.py --prolog-backend pool zad4 python sudoku.py`
+
+13. Wyniki programów w Prologu są zapamiętywane w katalogu `.prolog_cache`
+    (ten sam program nie jest uruchamiany ponownie); wyłączenie pamięci:
+  `python validator.py --prolog-cache '' zad4 python sudoku.py`
+
+14. Sprawdzenie gotowych odpowiedzi do zad4 i zad5 (list zamiast programów
+    w Prologu) bez uruchamiania `swipl`:
+  `python validator.py --check-answers zad4 cat odpowiedz.txt`
+
 
 '''
 
@@ -32,20 +58,96 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import argparse
+import atexit
+import contextlib
+import hashlib
+import importlib
+import json
 import os
+import shutil
 import signal
 import subprocess
 import sys
+import tempfile
 import threading
 import time
 
+try:  # py3
+    import queue
+except ImportError:  # py2
+    import Queue as queue
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
 import numpy as np
 
 import yaml
 
+# History, calibration, --compare and JSON helpers are shared by the
+# validators of all lists. They are loaded from this file only when one of
+# those options is used, so plain grading works with the validator alone.
+GRADING_FILE = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, 'grading.py'))
+
 
 VERBOSE = False
 
+
+# SWI-Prolog executable, the number of persistent workers of the `pool`
+# backend and the line by which a worker reports a finished program. Cases
+# run one at a time, so a single worker is reused; more are only started for
+# concurrent callers.
+PROLOG_COMMAND = 'swipl'
+PROLOG_POOL_SIZE = 1
+PROLOG_SENTINEL = '__prolog_validator_done__'
+# Evaluating a program may take this long, in seconds, unless the case sets
+# `prolog_timeout`. Either is scaled by --timeout-multiplier like `timeout`.
+PROLOG_TIMEOUT = 10.0
+# Set by --check-answers: outputs are the answers themselves (e.g. stored
+# answers checked in bulk), not Prolog programs, and swipl is not run.
+CHECK_ANSWERS = False
+
+# Read requests run(Dir, File, Out) and consult File in a fresh module, with
+# Dir as the working directory and the output going to Out. The sentinel line
+# also carries the CPU time of the program in seconds.
+PROLOG_DRIVER = r'''
+:- initialization(main, main).
+
+main :-
+    repeat,
+    read_term(user_input, Request, []),
+    (   Request == end_of_file
+    ->  halt
+    ;   statistics(cputime, Start),
+        (   catch(run_request(Request), Error, print_message(error, Error))
+        ->  true
+        ;   true
+        ),
+        statistics(cputime, End),
+        CpuTime is End - Start,
+        format(user_output, '~w ~w~n', ['%s', CpuTime]),
+        flush_output(user_output),
+        fail
+    ).
+
+run_request(run(Dir, File, Out)) :-
+    working_directory(Old, Dir),
+    open(Out, write, Stream),
+    set_output(Stream),
+    catch(in_temporary_module(M, true, load_files(M:File, [silent(true)])),
+          Error, print_message(error, Error)),
+    set_output(user_output),
+    close(Stream),
+    working_directory(_, Old).
+''' % (PROLOG_SENTINEL,)
+# The pool backend runs this program on its first worker and falls back to
+# the subprocess backend unless it prints the expected output, e.g. when the
+# driver does not work with the installed swipl.
+PROLOG_POOL_CHECK = (':- X is 6 * 7, write(X), nl.\n', '42')
+
 # Tests embedded into the validator.
 DEFAULT_TESTSET_YAML = (
     u'''
@@ -731,7 +833,7 @@ zad4:
     timeout: 2 # second
     input_file: zad_input.txt
     output_file: zad_output.txt
-  validator: prolog_validator
+  validator: sudoku_validator
   cases:
     - inp: |  
         89.356.1.
@@ -777,7 +879,7 @@ zad5:
     timeout: 8 # second
     input_file: zad_input.txt
     output_file: zad_output.txt
-  validator: prolog_validator
+  validator: storms_validator
   cases:
     - inp: |
         4 4 0 5 5 5
@@ -897,11 +999,36 @@ DEFAULT_TESTSET = yaml.load(DEFAULT_TESTSET_YAML)
 # Comparison functions
 
 class ValidatorException(Exception):
-    pass
+    """
+    A failed case. `measurements` keeps what was measured before it failed,
+    e.g. the run time, for the JSON and history records.
+    """
+
+    def __init__(self, message, measurements=None):
+        Exception.__init__(self, message)
+        self.measurements = dict(measurements or {})
 
 
-def fail(message):
-    raise ValidatorException(message)
+def fail(message, measurements=None):
+    raise ValidatorException(message, measurements)
+
+
+def load_grading():
+    """
+    Load GRADING_FILE by path, without putting its directory on sys.path.
+    Returns None if the validator was copied out of the repository.
+    """
+    if not os.path.isfile(GRADING_FILE):
+        return None
+    try:
+        from importlib.util import module_from_spec, spec_from_file_location
+    except ImportError:  # py2
+        import imp
+        return imp.load_source('grading', GRADING_FILE)
+    spec = spec_from_file_location('grading', GRADING_FILE)
+    grading = module_from_spec(spec)
+    spec.loader.exec_module(grading)
+    return grading
 
 
 def compare(returned, expected, message="Contents"):
@@ -930,25 +1057,498 @@ def perlines_validator(case, process_out, line_compare_fun=compare):
             zip(process_lines, ref_lines)):
         line_compare_fun(proc_line, ref_line, "Line %d contents" % (lnum + 1,))
 
+def run_prolog(program, timeout):
+    """
+    Run a Prolog program in its own scratch directory, so that the files it
+    writes do not leak between cases. Returns its output and measurements.
+    """
+    scratch_dir = tempfile.mkdtemp(prefix='prolog_')
+    try:
+        program_file = os.path.join(scratch_dir, 'solution.pl')
+        result_file = os.path.join(scratch_dir, 'prolog_result.txt')
+        with open(program_file, 'w') as prolog_file:
+            prolog_file.write(program)
+
+        start = time.time()
+        try:
+            cpu_time = PROLOG_BACKEND.run(
+                program_file, result_file, scratch_dir,
+                timeout if timeout > 0 else None)
+        except ValidatorException as e:
+            e.measurements['prolog_wall_time'] = time.time() - start
+            raise
+        wall_time = time.time() - start
+
+        with open(result_file, 'r') as prolog_result:
+            result = prolog_result.read()
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    measurements = {'prolog_wall_time': wall_time}
+    if cpu_time is not None:
+        measurements['prolog_cpu_time'] = cpu_time
+    return result, measurements
+
+
+def prolog_output(case, program):
+    """
+    Output of a generated Prolog program, taken from PROLOG_CACHE or
+    computed by run_prolog. Returns the output and measurements. A cached
+    result counts as a timeout if its run took longer than the current
+    deadline allows.
+    """
+    timeout = case.get('prolog_timeout', PROLOG_TIMEOUT)
+    cached = PROLOG_CACHE and PROLOG_CACHE.get(program)
+    if cached:
+        wall_time = cached[1].get('prolog_wall_time', 0)
+        if timeout > 0 and wall_time > timeout:
+            fail('Prolog program timed out after %f s (cached run took '
+                 '%f s)' % (timeout, wall_time), cached[1])
+        return cached
+    result, measurements = run_prolog(program, timeout)
+    if PROLOG_CACHE:
+        PROLOG_CACHE.put(program, result, measurements)
+    return result, measurements
+
+
+@contextlib.contextmanager
+def failure_measurements(measurements):
+    """Adds measurements, e.g. Prolog timings, to failures in the block."""
+    try:
+        yield
+    except ValidatorException as e:
+        e.measurements.update(measurements)
+        raise
+
+
 def prolog_validator(case, process_out, line_compare_fun=compare):
     """
-    Compare two strings line by line, ignoring whitespaces.
+    Run the generated Prolog program (or take its result from PROLOG_CACHE)
+    and compare its output with the reference line by line, ignoring
+    whitespaces.
     """
     ref_lines = whitespace_normalize(case['out']).split('\n')
-    with open('solution.pl', 'w') as prolog_file:
-        prolog_file.write(process_out)
-        
-    
-    os.system('swipl -q -c solution.pl > prolog_result.txt') 
-    
-    with open('prolog_result.txt', 'r') as prolog_result:
-        process_out = prolog_result.read()
-        
-    process_lines = whitespace_normalize(process_out).split('\n')
-    compare(len(process_lines), len(ref_lines), "Number of lines")
-    for lnum, (proc_line, ref_line) in enumerate(
-            zip(process_lines, ref_lines)):
-        line_compare_fun(proc_line, ref_line, "Line %d contents" % (lnum + 1,))
+    process_out, measurements = prolog_output(case, process_out)
+    with failure_measurements(measurements):
+        process_lines = whitespace_normalize(process_out).split('\n')
+        compare(len(process_lines), len(ref_lines), "Number of lines")
+        for lnum, (proc_line, ref_line) in enumerate(
+                zip(process_lines, ref_lines)):
+            line_compare_fun(proc_line, ref_line,
+                             "Line %d contents" % (lnum + 1,))
+    return measurements
+
+
+def answer_output(case, process_out):
+    """
+    The answer given by the output of a solution: the output of the Prolog
+    program it generated or, with CHECK_ANSWERS, the output itself.
+    """
+    if CHECK_ANSWERS:
+        return process_out, {}
+    return prolog_output(case, process_out)
+
+
+def parse_int_list(text, length, what):
+    """Parses a Prolog list of `length` integers, e.g. [1,2,3]."""
+    text = text.strip()
+    if not (text.startswith('[') and text.endswith(']')):
+        fail('%s is not a list: %s' % (what, text[:100]))
+    try:
+        values = [int(v) for v in text[1:-1].split(',')]
+    except ValueError:
+        fail('%s is not a list of integers: %s' % (what, text[:100]))
+    compare(len(values), length, '%s length' % (what,))
+    return np.array(values)
+
+
+def sudoku_validator(case, process_out):
+    """
+    Check that the answer to a Sudoku keeps the given digits and that every
+    row, column and box holds the digits 1..9. Any valid solution passes.
+    The answer is the list printed by the generated Prolog program.
+    """
+    process_out, measurements = answer_output(case, process_out)
+    with failure_measurements(measurements):
+        grid = parse_int_list(process_out, 81, 'Solution').reshape(9, 9)
+
+        givens = np.zeros((9, 9), dtype=int)
+        for r, line in enumerate(case['inp'].split()[:9]):
+            for c, char in enumerate(line[:9]):
+                if char.isdigit():
+                    givens[r, c] = int(char)
+        changed = np.argwhere((givens > 0) & (grid != givens))
+        if len(changed):
+            r, c = changed[0]
+            fail('Given digit %d in row %d, column %d was changed to %d' % (
+                givens[r, c], r + 1, c + 1, grid[r, c]))
+
+        boxes = grid.reshape(3, 3, 3, 3).swapaxes(1, 2).reshape(9, 9)
+        units = np.concatenate([grid, grid.T, boxes])
+        bad = np.flatnonzero(
+            (np.sort(units, axis=1) != np.arange(1, 10)).any(axis=1))
+        if len(bad):
+            kind, num = divmod(bad[0], 9)
+            fail('%s %d does not hold the digits 1..9' % (
+                ('Row', 'Column', 'Box')[kind], num + 1))
+    return measurements
+
+def first_cell(mask):
+    """Row and column (counted from 0) of the first set cell of a mask."""
+    return tuple(np.argwhere(mask)[0])
+
+
+def storms_validator(case, process_out):
+    """
+    Check a storms (Burze) answer: a 0/1 grid with the given row and column
+    sums and the given cells, in which storms are rectangles of size at
+    least 2x2 that do not touch, not even diagonally. Any valid grid passes.
+    Cells of the input triples are counted from 0, the messages count rows
+    and columns from 1.
+    """
+    lines = [l.split() for l in case['inp'].split('\n') if l.strip()]
+    row_sums = np.array([int(v) for v in lines[0]])
+    col_sums = np.array([int(v) for v in lines[1]])
+    num_rows, num_cols = len(row_sums), len(col_sums)
+
+    process_out, measurements = answer_output(case, process_out)
+    with failure_measurements(measurements):
+        grid = parse_int_list(
+            process_out, num_rows * num_cols, 'Solution').reshape(
+                num_rows, num_cols)
+        if ((grid != 0) & (grid != 1)).any():
+            r, c = first_cell((grid != 0) & (grid != 1))
+            fail('Cell in row %d, column %d is %d, not 0 or 1' % (
+                r + 1, c + 1, grid[r, c]))
+
+        for what, sums, ref_sums in (('Row', grid.sum(1), row_sums),
+                                     ('Column', grid.sum(0), col_sums)):
+            bad = np.flatnonzero(sums != ref_sums)
+            if len(bad):
+                compare(sums[bad[0]], ref_sums[bad[0]],
+                        '%s %d sum' % (what, bad[0] + 1))
+        for line in lines[2:]:
+            r, c, value = [int(v) for v in line]
+            if not (0 <= r < num_rows and 0 <= c < num_cols):
+                fail('Given cell (%d, %d) is outside the %dx%d grid' % (
+                    r, c, num_rows, num_cols))
+            compare(grid[r, c], value,
+                    'Cell in row %d, column %d' % (r + 1, c + 1))
+
+        # 2x2 windows with three storm cells are corners of touching storms,
+        # with two diagonal cells storms touch by a corner.
+        top_left, top_right = grid[:-1, :-1], grid[:-1, 1:]
+        bottom_left, bottom_right = grid[1:, :-1], grid[1:, 1:]
+        window = top_left + top_right + bottom_left + bottom_right
+        diagonal = ((window == 2) & (top_left == bottom_right) &
+                    (top_left != top_right))
+        for mask, what in ((window == 3, 'three storm cells'),
+                           (diagonal, 'storm cells touching diagonally')):
+            if mask.any():
+                r, c = first_cell(mask)
+                fail('The 2x2 square at row %d, column %d has %s' % (
+                    r + 1, c + 1, what))
+
+        # Storms are at least 2x2: every storm cell has a neighbour in its
+        # row and one in its column.
+        padded = np.pad(grid, 1, 'constant')
+        horizontal = (padded[1:-1, :-2] | padded[1:-1, 2:]).astype(bool)
+        vertical = (padded[:-2, 1:-1] | padded[2:, 1:-1]).astype(bool)
+        thin = (grid == 1) & ~(horizontal & vertical)
+        if thin.any():
+            r, c = first_cell(thin)
+            fail('The storm at row %d, column %d is narrower than 2 cells' % (
+                r + 1, c + 1))
+    return measurements
+
+# Prolog backends
+
+class SubprocessProlog(object):
+    """
+    Runs every program in a new swipl process. Backends return the CPU time
+    of the program in seconds, or None if it is not known.
+    """
+
+    def run(self, program_file, result_file, workdir, timeout=None):
+        if os.name == 'nt':
+            kwargs = {}
+        else:
+            kwargs = {'preexec_fn': os.setpgrp}
+        usage = resource and resource.getrusage(resource.RUSAGE_CHILDREN)
+        with open(result_file, 'wb') as result_f:
+            try:
+                process = subprocess.Popen(
+                    [PROLOG_COMMAND, '-q', '-c', program_file],
+                    stdout=result_f, cwd=workdir, **kwargs)
+            except OSError as e:
+                fail('Cannot run %s: %s' % (PROLOG_COMMAND, e))
+            timed_out = threading.Event()
+            if timeout:
+                timer = threading.Timer(
+                    timeout, lambda: timed_out.set() or kill_proc(process))
+                timer.start()
+            try:
+                process.wait()
+            finally:
+                if timeout:
+                    timer.cancel()
+        if timed_out.is_set():
+            fail('Prolog program timed out after %f s' % (timeout,))
+        if usage is None:
+            return None
+        new_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return (new_usage.ru_utime + new_usage.ru_stime -
+                usage.ru_utime - usage.ru_stime)
+
+    def close(self):
+        pass
+
+
+def prolog_atom(text):
+    return "'%s'" % (text.replace('\\', '\\\\').replace("'", "\\'"),)
+
+
+class PrologWorker(object):
+    """
+    A long-lived swipl process running PROLOG_DRIVER. A thread moves its
+    output lines to a queue, so that waiting for a program can time out.
+    """
+
+    def __init__(self, driver_file):
+        self.process = subprocess.Popen(
+            [PROLOG_COMMAND, '-q', driver_file],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.lines = queue.Queue()
+        reader = threading.Thread(target=self.read_lines)
+        reader.daemon = True
+        reader.start()
+
+    def read_lines(self):
+        for line in iter(self.process.stdout.readline, b''):
+            self.lines.put(line.decode('utf8', 'replace').strip())
+        self.lines.put(None)
+
+    def run(self, program_file, result_file, workdir, timeout=None):
+        """
+        Returns (finished, cpu_time). The worker must be replaced if it has
+        not finished, i.e. it exited (e.g. the program called halt). Raises
+        queue.Empty if the program does not finish within the timeout.
+        """
+        request = 'run(%s, %s, %s).\n' % (
+            prolog_atom(workdir), prolog_atom(program_file),
+            prolog_atom(result_file))
+        self.process.stdin.write(request.encode('utf8'))
+        self.process.stdin.flush()
+        # The deadline covers the whole program, not each line it prints.
+        deadline = timeout and time.time() + timeout
+        while True:
+            remaining = None
+            if deadline:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise queue.Empty()
+            line = self.lines.get(timeout=remaining)
+            if line is None:
+                return False, None
+            if line.startswith(PROLOG_SENTINEL):
+                return True, float(line.split()[1])
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+
+class SwiplPool(object):
+    """
+    Pool of persistent swipl workers, which consult each program in a fresh
+    temporary module, so that swipl starts only once. If the workers cannot
+    be started or fail PROLOG_POOL_CHECK the programs are run by the
+    subprocess backend.
+    """
+
+    def __init__(self, size=PROLOG_POOL_SIZE):
+        self.size = size
+        self.idle = queue.Queue()
+        self.num_started = 0
+        self.checked = False
+        self.fallback = None
+        self.lock = threading.Lock()
+        self.check_lock = threading.Lock()
+        driver_f = tempfile.NamedTemporaryFile(
+            'w', suffix='.pl', delete=False)
+        with driver_f:
+            driver_f.write(PROLOG_DRIVER)
+        self.driver_file = driver_f.name
+
+    def get_worker(self):
+        with self.lock:
+            if self.idle.empty() and self.num_started < self.size:
+                self.num_started += 1
+                return PrologWorker(self.driver_file)
+        return self.idle.get()
+
+    def check(self):
+        """
+        Run PROLOG_POOL_CHECK. Returns None if the workers work, otherwise
+        the reason to fall back to the subprocess backend.
+        """
+        program, expected = PROLOG_POOL_CHECK
+        scratch_dir = tempfile.mkdtemp(prefix='prolog_')
+        try:
+            program_file = os.path.join(scratch_dir, 'check.pl')
+            result_file = os.path.join(scratch_dir, 'prolog_result.txt')
+            with open(program_file, 'w') as prolog_file:
+                prolog_file.write(program)
+            try:
+                self.run_worker(program_file, result_file, scratch_dir,
+                                PROLOG_TIMEOUT)
+                with open(result_file, 'r') as prolog_result:
+                    result = prolog_result.read().strip()
+            except (IOError, OSError, ValidatorException) as e:
+                return str(e)
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+        if result != expected:
+            return 'a test program printed "%s" instead of "%s"' % (
+                result, expected)
+        return None
+
+    def run(self, program_file, result_file, workdir, timeout=None):
+        with self.check_lock:
+            if not self.checked:
+                self.checked = True
+                reason = self.check()
+                if reason is not None:
+                    print('%s workers do not work (%s), running swipl once '
+                          'per program.' % (PROLOG_COMMAND, reason))
+                    self.fallback = SubprocessProlog()
+        if self.fallback:
+            return self.fallback.run(program_file, result_file, workdir,
+                                     timeout)
+        return self.run_worker(program_file, result_file, workdir, timeout)
+
+    def run_worker(self, program_file, result_file, workdir, timeout):
+        worker = self.get_worker()
+        try:
+            finished, cpu_time = worker.run(
+                program_file, result_file, workdir, timeout)
+        except queue.Empty:
+            worker.kill()
+            with self.lock:
+                self.num_started -= 1
+            fail('Prolog program timed out after %f s' % (timeout,))
+        if finished:
+            self.idle.put(worker)
+        else:
+            worker.close()
+            with self.lock:
+                self.num_started -= 1
+        return cpu_time
+
+    def close(self):
+        with self.lock:
+            while not self.idle.empty():
+                self.idle.get().close()
+        os.remove(self.driver_file)
+
+
+# Backends by name. --prolog-backend also accepts MODULE:CLASS, e.g. a
+# stand-in that does not need swipl.
+PROLOG_BACKENDS = {
+    'pool': SwiplPool,
+    'subprocess': SubprocessProlog,
+    }
+
+
+def get_prolog_backend(name):
+    if name in PROLOG_BACKENDS:
+        return PROLOG_BACKENDS[name]()
+    if ':' not in name:
+        fail('Unknown Prolog backend %s, choose one of %s or give '
+             'MODULE:CLASS' % (name, ', '.join(sorted(PROLOG_BACKENDS))))
+    module_name, class_name = name.split(':', 1)
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+PROLOG_BACKEND = SubprocessProlog()
+
+
+class PrologCache(object):
+    """
+    Results of generated Prolog programs, one JSON file per program in the
+    cache directory. The key is the SHA-1 of the program text and of the
+    swipl version, so that upgrading swipl invalidates the cache. Hits
+    return the stored result and the timings measured when the program was
+    run, with `prolog_cache_hits` set to 1.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+
+    def get_version(self):
+        if self.version is None:
+            try:
+                self.version = subprocess.check_output(
+                    [PROLOG_COMMAND, '--version']).decode('utf8', 'replace')
+            except (OSError, subprocess.CalledProcessError):
+                self.version = ''
+        return self.version
+
+    def get_path(self, program):
+        digest = hashlib.sha1()
+        digest.update(self.get_version().encode('utf8'))
+        digest.update(b'\0')
+        digest.update(ensure_unicode(program).encode('utf8'))
+        return os.path.join(self.directory, digest.hexdigest() + '.json')
+
+    def get(self, program):
+        """Returns (result, measurements), or None if not cached."""
+        if not self.get_version():
+            return None  # swipl cannot be run, do not cache
+        try:
+            with open(self.get_path(program)) as entry_f:
+                entry = json.load(entry_f)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        measurements = dict(entry['measurements'])
+        measurements['prolog_cache_hits'] = 1
+        return entry['result'], measurements
+
+    def put(self, program, result, measurements):
+        if not self.get_version():
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = self.get_path(program)
+        # Write and rename, so that a concurrent run never reads half an entry.
+        entry_f = tempfile.NamedTemporaryFile(
+            'w', dir=self.directory, suffix='.tmp', delete=False)
+        with entry_f:
+            json.dump({'result': result, 'measurements': measurements},
+                      entry_f)
+        try:
+            os.rename(entry_f.name, path)
+        except OSError:  # Windows does not replace existing files
+            os.remove(entry_f.name)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return 'Prolog result cache: %d/%d hits (%.1f%%).' % (
+            self.hits, total, 100.0 * self.hits / total if total else 0.0)
+
+
+PROLOG_CACHE = None
+
 
 # Comparison function utils
 def ensure_unicode(obj):
@@ -1001,15 +1601,31 @@ else:
             os.killpg(os.getpgid(process.pid), signal.SIGTERM)
 
 
-def run_and_score_case(program, defaults, case_def, validator, timeout_multiplier):
+def run_and_score_case(program, defaults, case_def, validator, timeout_multiplier,
+                       phases=None):
+    if phases is None:
+        phases = {}
     opts = dict(defaults)
     opts.update(case_def)
     opts['timeout'] *= timeout_multiplier
-    process_out, elapsed_time = run_case(program, **opts)
+    opts['prolog_timeout'] = (
+        opts.get('prolog_timeout', PROLOG_TIMEOUT) * timeout_multiplier)
+    start = time.time()
+    try:
+        process_out, elapsed_time = run_case(program, **opts)
+    finally:
+        phases['run'] = time.time() - start
     if VERBOSE:
         print("Got output:")
         print(process_out)
-    measurements = validator(opts, process_out)
+    start = time.time()
+    try:
+        measurements = validator(opts, process_out)
+    except ValidatorException as e:
+        e.measurements['time'] = elapsed_time
+        raise
+    finally:
+        phases['validate'] = time.time() - start
     measurements = measurements or {}
     measurements['time'] = elapsed_time
     return measurements
@@ -1017,8 +1633,8 @@ def run_and_score_case(program, defaults, case_def, validator, timeout_multiplie
 
 def run_case(program, inp, out=None,
              input_file='<stdin>', output_file='<stdout>',
-             timeout=1.0):
-    del out  # unused
+             timeout=1.0, **case_info):
+    del out, case_info  # unused
     inp = ensure_unicode(inp)
     if inp[-1] != '\n':
         inp += '\n'
@@ -1062,11 +1678,13 @@ def run_case(program, inp, out=None,
         if timeout > 0:
             timer.cancel()
     if process.poll() != 0:
-        fail("Bad process exit status: %d" % (process.poll(),))
+        fail("Bad process exit status: %d" % (process.poll(),),
+             {'time': elapsed})
 
     if output_file != '<stdout>':
         if not os.path.isfile(output_file):
-            fail("Output file %s does not exist" % (output_file, ))
+            fail("Output file %s does not exist" % (output_file, ),
+                 {'time': elapsed})
         with open(output_file, 'rb') as out_f:
             process_out = out_f.read()
     process_out = process_out.decode('utf8')
@@ -1104,6 +1722,54 @@ def get_argparser():
     parser.add_argument(
         '--timeout-multiplier', '-tm',
         help='Multiply timeout by provided amount, e.g. 2.13')
+    parser.add_argument(
+        '--calibrate', default=False, action='store_true',
+        help='Run the program as the reference solution and store per-case '
+             'timeout scales for this machine.')
+    parser.add_argument(
+        '--calibration-file', default='.calibration_result',
+        help='File with per-case timeout scales.')
+    parser.add_argument(
+        '--calibration-repeats', default=3, type=int,
+        help='Number of reference runs per case during calibration.')
+    parser.add_argument(
+        '--json-out', default='',
+        help='Stream JSON records with per-case results to this file.')
+    parser.add_argument(
+        '--history-db', default='',
+        help='SQLite file in which results of every case are recorded.')
+    parser.add_argument(
+        '--history-report', choices=['slowest', 'trend', 'regressions'],
+        help='Print a report from --history-db instead of running cases.')
+    parser.add_argument(
+        '--history-solution', default='',
+        help='Limit the history report to solution hashes with this prefix.')
+    parser.add_argument(
+        '--history-threshold', default=10.0, type=float,
+        help='Slowdown, in percent, reported as a regression.')
+    parser.add_argument(
+        '--history-order', default=False, action='store_true',
+        help='Run the cases that failed most often or took longest first.')
+    parser.add_argument(
+        '--compare', default=False, action='store_true',
+        help='Compare the speed of two programs given as PROG_A -- PROG_B.')
+    parser.add_argument(
+        '--compare-repeats', default=5, type=int,
+        help='Number of runs of each program per case in --compare mode.')
+    parser.add_argument(
+        '--prolog-backend', default='subprocess',
+        help='How prolog_validator runs swipl: subprocess (one process per '
+             'program), pool (persistent workers, checked on a test program '
+             'first) or MODULE:CLASS.')
+    parser.add_argument(
+        '--prolog-cache', default='.prolog_cache',
+        help='Directory with cached results of generated Prolog programs, '
+             'an empty string disables the cache.')
+    parser.add_argument(
+        '--check-answers', default=False, action='store_true',
+        help='The program prints answers (e.g. stored ones) instead of Prolog '
+             'programs, sudoku_validator and storms_validator check them '
+             'without running swipl.')
     parser.add_argument(
         '--verbose', default=False, action='store_true',
         help='Print more information about solutions.')
@@ -1151,6 +1817,11 @@ if __name__ == '__main__':
     parser = get_argparser()
     args = parser.parse_args()
     VERBOSE = args.verbose
+    PROLOG_BACKEND = get_prolog_backend(args.prolog_backend)
+    atexit.register(PROLOG_BACKEND.close)
+    if args.prolog_cache:
+        PROLOG_CACHE = PrologCache(args.prolog_cache)
+    CHECK_ANSWERS = args.check_answers
 
     if args.testset:
         with open(args.testset) as testset_f:
@@ -1164,29 +1835,135 @@ if __name__ == '__main__':
     problem_def = testset[args.problem]
     problem_validator = eval(problem_def['validator'])
     problem_cases = get_cases(problem_def, args.cases)
+    testset_key = args.testset or 'default'
+
+    grading = None
+    if (args.history_db or args.calibrate or args.compare or
+            args.json_out or os.path.isfile(args.calibration_file)):
+        grading = load_grading()
+        if grading is None:
+            parser.error(
+                '%s not found. --history-db, --calibrate, --compare, '
+                '--json-out and the calibration file %s need it, run the '
+                'validator from the repository.' % (
+                    GRADING_FILE, args.calibration_file))
+
+    history = None
+    if args.history_db:
+        history = grading.GradingHistory(args.history_db)
+    if args.history_report:
+        if not history:
+            parser.error('--history-report requires --history-db')
+        grading.print_history_report(
+            history, args.history_report, testset_key, args.problem,
+            args.history_solution, args.history_threshold)
+        sys.exit()
+
     program = get_program(args.program)
 
     if args.show_example:
         show_example(problem_def['defaults'], next(problem_cases)[1])
         sys.exit()
 
+    if args.stdio:
+        problem_def['defaults']['input_file'] = '<stdin>'
+        problem_def['defaults']['output_file'] = '<stdout>'
+
+    calibration = {}
+    if grading:
+        calibration = grading.load_calibration(args.calibration_file)
+
+    def get_case_scale(case_num):
+        if grading is None:
+            return 1.0
+        return grading.get_case_scale(
+            calibration, testset_key, args.problem, case_num, 1.0)
+
+    if args.calibrate:
+        factors = grading.calibrate_cases(
+            run_and_score_case, ValidatorException, program,
+            problem_def['defaults'], problem_cases, problem_validator,
+            args.calibration_repeats)
+        calibration.setdefault(testset_key, {}).setdefault(
+            args.problem, {}).update(factors)
+        with open(args.calibration_file, 'w') as calibration_f:
+            yaml.safe_dump(calibration, calibration_f,
+                           default_flow_style=False)
+        print('\nCalibrated %d cases, results saved in %s.' % (
+            len(factors), args.calibration_file))
+        sys.exit()
+
+    if args.compare:
+        if '--' not in args.program:
+            parser.error('--compare expects PROG_A -- PROG_B')
+        split = args.program.index('--')
+        programs = [get_program(args.program[:split]),
+                    get_program(args.program[split + 1:])]
+        timeout_multiplier = float(args.timeout_multiplier) if args.timeout_multiplier and float(args.timeout_multiplier) > 1 else 1
+        grading.compare_programs(
+            run_and_score_case, ValidatorException, programs,
+            problem_def['defaults'], problem_cases, problem_validator,
+            lambda case_num: timeout_multiplier * get_case_scale(case_num),
+            args.compare_repeats)
+        sys.exit()
+
+    host = solution = None
+    if grading:
+        host = grading.get_host_fingerprint()
+        solution = grading.get_solution_hash(args.program)
+    json_out = None
+    if args.json_out:
+        json_out = open(args.json_out, 'w')
+    if history:
+        history.start_run(solution, program, testset_key, args.problem, host)
+        if args.history_order:
+            problem_cases = list(problem_cases)
+            case_order = history.case_order(
+                testset_key, args.problem,
+                [case_num for case_num, _ in problem_cases])
+            problem_cases = sorted(
+                problem_cases,
+                key=lambda case: case_order.index(case[0]))
+
     failed_cases = []
     ok_cases = []
+    t_start = time.time()
     for case_num, case_def in problem_cases:
         print('Running case %d... ' % (case_num,), end='')
+        case_scale = get_case_scale(case_num)
+        case_meas, case_phases, message = {}, {}, None
         try:
             timeout_multiplier = float(args.timeout_multiplier) if args.timeout_multiplier and float(args.timeout_multiplier) > 1 else 1
             if args.stdio:
                 case_def['input_file'] = '<stdin>'
                 case_def['output_file'] = '<stdout>'
             case_meas = run_and_score_case(
-                program, problem_def['defaults'], case_def, problem_validator, timeout_multiplier)
+                program, problem_def['defaults'], case_def,
+                problem_validator, timeout_multiplier * case_scale,
+                phases=case_phases)
             ok_cases.append((case_num, case_meas))
             print('OK!')
         except ValidatorException as e:
+            message = str(e)
+            case_meas = e.measurements
             failed_cases.append(case_num)
             print('Failed:')
-            print(str(e))
+            print(message)
+        if json_out:
+            grading.write_json_record(json_out, {
+                'type': 'case',
+                'problem': args.problem,
+                'case': case_num,
+                'status': 'failed' if message is not None else 'ok',
+                'message': message,
+                'measurements': case_meas,
+                'phases': case_phases,
+                'timeout_scale': case_scale,
+                'host': host,
+                'solution': solution,
+                })
+        if history:
+            history.add_result(case_num, message, case_meas)
 
     print('\nValidation result: %d/%d cases pass.\n' % (
         len(ok_cases), len(ok_cases) + len(failed_cases)))
@@ -1197,6 +1974,22 @@ if __name__ == '__main__':
             tot_meas[k] = tot_meas.get(k, 0) + v
     for k, v in tot_meas.items():
         print("For passing cases total %s: %s" % (k, v))
+    if PROLOG_CACHE and PROLOG_CACHE.hits + PROLOG_CACHE.misses:
+        print(PROLOG_CACHE.stats())
+
+    if json_out:
+        grading.write_json_record(json_out, {
+            'type': 'summary',
+            'problem': args.problem,
+            'passed': len(ok_cases),
+            'total': len(ok_cases) + len(failed_cases),
+            'failed_cases': failed_cases,
+            'totals': tot_meas,
+            'eval_time': time.time() - t_start,
+            'host': host,
+            'solution': solution,
+            })
+        json_out.close()
 
     if failed_cases:
         print('\nSome test cases have failed. '
@@ -24,6 +24,19 @@ Prosta sprawdzarka. Przykłady użycia:
 7. Ustawienie mnożnika dla limitów czasowych:
   `python validator.py --timeout-multiplier 2.5 zad1 python rozwiazanie.py`
 
+8. Kalibracja limitów czasowych rozwiązaniem wzorcowym:
+  `python ai_nonogram_validator.py --calibrate obrazki_wzorcowka`
+
+9. Zapisanie wyników w formacie JSON (jeden rekord na linię):
+  `python ai_nonogram_validator.py --json-out wyniki.jsonl obrazki_XXXX`
+
+10. Zapisanie wyników w bazie SQLite i raport z historii ocen:
+  `python ai_nonogram_validator.py --history-db historia.db obrazki_XXXX`
+  `python ai_nonogram_validator.py --history-db historia.db --history-report regressions`
+
+11. Porównanie szybkości dwóch rozwiązań:
+  `python ai_nonogram_validator.py --compare obrazki_nowe obrazki_stare`
+
 
 '''
 
@@ -43,6 +56,12 @@ import numpy as np
 
 import yaml
 
+# History, calibration, --compare and JSON helpers are shared by the
+# validators of all lists. They are loaded from this file only when one of
+# those options is used, so plain grading works with the validator alone.
+GRADING_FILE = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, 'grading.py'))
+
 DEFAULT_TESTSET_YAML = u'''
 zad1: {}
 '''
@@ -53,14 +72,45 @@ SKILL = "/pio/scratch/2/ai_solutions/skill"
 
 VERBOSE = False
 
+
+# Images with at least that many cells are checked bit-packed, see
+# nonogram_benchmark.py.
+BITPACKED_MIN_CELLS = 2500
+
+
 # Comparison functions
 
 class ValidatorException(Exception):
-    pass
+    """
+    A failed case. `measurements` keeps what was measured before it failed,
+    e.g. the run time, for the JSON and history records.
+    """
+
+    def __init__(self, message, measurements=None):
+        Exception.__init__(self, message)
+        self.measurements = dict(measurements or {})
 
 
-def fail(message):
-    raise ValidatorException(message)
+def fail(message, measurements=None):
+    raise ValidatorException(message, measurements)
+
+
+def load_grading():
+    """
+    Load GRADING_FILE by path, without putting its directory on sys.path.
+    Returns None if the validator was copied out of the repository.
+    """
+    if not os.path.isfile(GRADING_FILE):
+        return None
+    try:
+        from importlib.util import module_from_spec, spec_from_file_location
+    except ImportError:  # py2
+        import imp
+        return imp.load_source('grading', GRADING_FILE)
+    spec = spec_from_file_location('grading', GRADING_FILE)
+    grading = module_from_spec(spec)
+    spec.loader.exec_module(grading)
+    return grading
 
 
 def compare(returned, expected, message="Contents"):
@@ -110,21 +160,147 @@ def count_blocks(r):
     return ret
 
 
-def nonogram_validator(case, process_out):
+def pack_clues(lines):
+    """
+    Packs clue lines into an array of block counts per line and one array of
+    all block lengths. An empty line is given as a single zero.
+    """
+    lines = [[b for b in l if b > 0] for l in lines]
+    counts = np.array([len(l) for l in lines], dtype=np.int64)
+    lengths = np.array([b for l in lines for b in l], dtype=np.int64)
+    return counts, lengths
+
+
+def run_lengths(img):
+    """
+    Block counts and lengths of all rows of a 0/1 image, in the format of
+    pack_clues, computed with np.diff on the image padded with zeros.
+    """
+    padded = np.zeros((img.shape[0], img.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = img != 0
+    edges = np.diff(padded, axis=1)
+    start_rows, start_cols = np.nonzero(edges == 1)
+    _, end_cols = np.nonzero(edges == -1)
+    counts = np.bincount(start_rows, minlength=img.shape[0])
+    return counts, end_cols - start_cols
+
+
+def pack_image(img):
+    """
+    Packs a 0/1 image into one Python int, row after row, with a zero bit
+    after every row so that blocks never span two rows. Returns the int and
+    the number of bits per row.
+    """
+    padded = np.zeros((img.shape[0], img.shape[1] + 1), dtype=np.uint8)
+    padded[:, :-1] = img != 0
+    packed = np.packbits(padded.ravel(), bitorder='little')
+    return int.from_bytes(packed.tobytes(), 'little'), img.shape[1] + 1
+
+
+def bit_positions(bits, num_bits):
+    packed = np.frombuffer(bits.to_bytes(num_bits // 8 + 1, 'little'),
+                           dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(packed, bitorder='little'))
+
+
+def bit_run_lengths(bits, num_lines, width):
+    """
+    run_lengths of an image packed with pack_image. Block edges of all
+    lines are found with one shift and xor of the whole int.
+    """
+    # Set bits of the xor are the block starts and the cells just after the
+    # block ends, alternating.
+    edges = bit_positions(bits ^ (bits << 1), num_lines * width)
+    starts = edges[0::2]
+    counts = np.bincount(starts // width, minlength=num_lines)
+    return counts, edges[1::2] - starts
+
+
+def first_mismatch(clues, runs):
+    """
+    Index of the first line whose blocks differ from the clues, or None.
+    """
+    clue_counts, clue_lengths = clues
+    run_counts, run_lengths = runs
+    bad_counts = np.nonzero(clue_counts != run_counts)[0]
+    first_bad = bad_counts[0] if len(bad_counts) else len(clue_counts)
+    # Lengths are comparable up to the first line with a wrong count.
+    num_lengths = clue_counts[:first_bad].sum()
+    bad_lengths = np.nonzero(
+        clue_lengths[:num_lengths] != run_lengths[:num_lengths])[0]
+    if len(bad_lengths):
+        return int(np.searchsorted(
+            np.cumsum(clue_counts), bad_lengths[0], side='right'))
+    if first_bad < len(clue_counts):
+        return int(first_bad)
+    return None
+
+
+def compile_nonogram_case(case):
+    """
+    Parses the clues of a case into the image shape and packed row and
+    column clues.
+    """
     case_def = [[int(i) for i in l.split()]
                 for l in case['inp'].split('\n') if l.strip()]
+    num_rows = case_def[0][0]
+    return {
+        'shape': tuple(case_def[0]),
+        'rows': pack_clues(case_def[1:num_rows + 1]),
+        'cols': pack_clues(case_def[num_rows + 1:]),
+        }
+
+
+def compile_testset(testset):
+    """
+    Stores compiled clues under the `clues` key of every nonogram case, so
+    that they are parsed once per test set and not once per run.
+    """
+    for problem_def in testset.values():
+        if problem_def.get('validator') == 'nonogram_validator':
+            for case in problem_def['cases']:
+                case['clues'] = compile_nonogram_case(case)
+
+
+def parse_image(process_out, shape):
+    """
+    Parses the output image into a 0/1 array. Well-formed outputs, made of
+    exactly shape[0] lines of shape[1] '#' or '.' characters, are read with a
+    single np.frombuffer, others line by line.
+    """
+    data = process_out.encode('utf8').strip() + b'\n'
+    num_rows, num_cols = shape
+    if len(data) == num_rows * (num_cols + 1):
+        grid = np.frombuffer(data, dtype=np.uint8).reshape(
+            num_rows, num_cols + 1)
+        cells = grid[:, :-1]
+        is_dot = cells == ord('.')
+        if ((grid[:, -1] == ord('\n')).all() and
+                (is_dot | (cells == ord('#'))).all()):
+            return (~is_dot).astype(np.int8)
     img = [[0 if c=='.' else 1 for c in l.strip()]
            for l in process_out.split('\n') if l.strip()]
-    img = np.array(img)
+    return np.array(img)
+
 
-    if img.shape != tuple(case_def[0]):
+def nonogram_validator(case, process_out):
+    clues = case.get('clues') or compile_nonogram_case(case)
+    img = parse_image(process_out, clues['shape'])
+
+    if img.shape != clues['shape']:
         fail("Wrong output shape.")
-    ret_def = (
-        [[img.shape[0], img.shape[1]]] +
-        [count_blocks(r) for r in img] +
-        [count_blocks(r) for r in img.T])
-    if case_def != ret_def:
-        fail("Solution does not match spec.")
+    for name, lines, line_clues in (
+            ('row', img, clues['rows']),
+            ('column', img.T, clues['cols'])):
+        if lines.size >= BITPACKED_MIN_CELLS:
+            bits, width = pack_image(lines)
+            runs = bit_run_lengths(bits, lines.shape[0], width)
+        else:
+            runs = run_lengths(lines)
+        bad_line = first_mismatch(line_clues, runs)
+        if bad_line is not None:
+            fail("Solution does not match spec in %s %d." % (
+                name, bad_line + 1))
 
 
 # Comparison function utils
@@ -206,15 +382,29 @@ else:
                     subprocess.call([SKILL, '-KILL', '--', str(pid)])
 
 
-def run_and_score_case(program, defaults, case_def, validator, timeout_multiplier):
+def run_and_score_case(program, defaults, case_def, validator, timeout_multiplier,
+                       phases=None):
+    if phases is None:
+        phases = {}
     opts = dict(defaults)
     opts.update(case_def)
     opts['timeout'] *= timeout_multiplier
-    process_out, elapsed_time = run_case(program, **opts)
+    start = time.time()
+    try:
+        process_out, elapsed_time = run_case(program, **opts)
+    finally:
+        phases['run'] = time.time() - start
     if VERBOSE:
         print("Got output:")
         print(process_out)
-    measurements = validator(opts, process_out)
+    start = time.time()
+    try:
+        measurements = validator(opts, process_out)
+    except ValidatorException as e:
+        e.measurements['time'] = elapsed_time
+        raise
+    finally:
+        phases['validate'] = time.time() - start
     measurements = measurements or {}
     measurements['time'] = elapsed_time
     return measurements
@@ -222,8 +412,8 @@ def run_and_score_case(program, defaults, case_def, validator, timeout_multiplie
 
 def run_case(program, inp, out=None,
              input_file='<stdin>', output_file='<stdout>',
-             timeout=1.0):
-    del out  # unused
+             timeout=1.0, **case_info):
+    del out, case_info  # unused
     inp = ensure_unicode(inp)
     if inp[-1] != '\n':
         inp += '\n'
@@ -267,11 +457,13 @@ def run_case(program, inp, out=None,
         if timeout > 0:
             timer.cancel()
     if process.poll() != 0:
-        fail("Bad process exit status: %d" % (process.poll(),))
+        fail("Bad process exit status: %d" % (process.poll(),),
+             {'time': elapsed})
 
     if output_file != '<stdout>':
         if not os.path.isfile(output_file):
-            fail("Output file %s does not exist" % (output_file, ))
+            fail("Output file %s does not exist" % (output_file, ),
+                 {'time': elapsed})
         with open(output_file, 'rb') as out_f:
             process_out = out_f.read()
     process_out = process_out.decode('utf8')
@@ -286,6 +478,25 @@ def ensure_newline_string(obj):
     return obj
 
 
+class TestsetDumper(yaml.SafeDumper):
+    """
+    Dumps multi-line strings, e.g. clues and images, as literal blocks.
+    """
+
+
+def represent_text(dumper, data):
+    return dumper.represent_scalar(
+        'tag:yaml.org,2002:str', data, style='|' if '\n' in data else None)
+
+
+TestsetDumper.add_representer(type(''), represent_text)
+
+
+def dump_testset(testset, testset_f):
+    yaml.dump(testset, testset_f, Dumper=TestsetDumper,
+              default_flow_style=False, allow_unicode=True)
+
+
 def show_example(defaults, case_def):
     opts = dict(defaults)
     opts.update(case_def)
@@ -309,6 +520,40 @@ def get_argparser():
     parser.add_argument(
         '--timeout-multiplier', '-tm',
         help='Multiply timeout by provided amount, e.g. 2.13')
+    parser.add_argument(
+        '--calibrate', default=False, action='store_true',
+        help='Run program_dir as the reference solution and store per-case '
+             'timeout scales for this machine.')
+    parser.add_argument(
+        '--calibration-file', default='.calibration_result',
+        help='File with per-case timeout scales.')
+    parser.add_argument(
+        '--calibration-repeats', default=3, type=int,
+        help='Number of reference runs per case during calibration.')
+    parser.add_argument(
+        '--json-out', default='',
+        help='Stream JSON records with per-case results to this file.')
+    parser.add_argument(
+        '--history-db', default='',
+        help='SQLite file in which results of every case are recorded.')
+    parser.add_argument(
+        '--history-report', choices=['slowest', 'trend', 'regressions'],
+        help='Print a report from --history-db instead of running cases.')
+    parser.add_argument(
+        '--history-solution', default='',
+        help='Limit the history report to solution hashes with this prefix.')
+    parser.add_argument(
+        '--history-threshold', default=10.0, type=float,
+        help='Slowdown, in percent, reported as a regression.')
+    parser.add_argument(
+        '--history-order', default=False, action='store_true',
+        help='Run the cases that failed most often or took longest first.')
+    parser.add_argument(
+        '--compare', default='', metavar='PROGRAM_DIR_B',
+        help='Compare the speed of program_dir (A) with PROGRAM_DIR_B.')
+    parser.add_argument(
+        '--compare-repeats', default=5, type=int,
+        help='Number of runs of each program per case in --compare mode.')
     parser.add_argument(
         '--verbose', default=False, action='store_true',
         help='Print more information about solutions.')
@@ -324,7 +569,7 @@ def get_argparser():
         help='cgroup for ai_su')
     parser.add_argument("--results", default='')
     parser.add_argument(
-        'program_dir',
+        'program_dir', nargs='?', default='',
         help='Program dir to execute, e.g. obrazki_jch.')
     return parser
 
@@ -371,6 +616,7 @@ if __name__ == '__main__':
 
     with open(args.testset) as testset_f:
         testset = yaml.load(testset_f)
+    compile_testset(testset)
     if args.problem not in testset:
         print('Problem not known: %s. Choose one of %s.' %
               (args.problem, ', '.join(sorted(testset.keys()))))
@@ -378,17 +624,101 @@ if __name__ == '__main__':
     problem_def = testset[args.problem]
     problem_validator = eval(problem_def['validator'])
     problem_cases = get_cases(problem_def, args.cases)
+    testset_key = args.testset or 'default'
+
+    grading = None
+    if (args.history_db or args.calibrate or args.compare or
+            args.json_out or os.path.isfile(args.calibration_file)):
+        grading = load_grading()
+        if grading is None:
+            parser.error(
+                '%s not found. --history-db, --calibrate, --compare, '
+                '--json-out and the calibration file %s need it, run the '
+                'validator from the repository.' % (
+                    GRADING_FILE, args.calibration_file))
+
+    history = None
+    if args.history_db:
+        history = grading.GradingHistory(args.history_db)
+    if args.history_report:
+        if not history:
+            parser.error('--history-report requires --history-db')
+        grading.print_history_report(
+            history, args.history_report, testset_key, args.problem,
+            args.history_solution, args.history_threshold)
+        sys.exit()
+
+    if not args.program_dir:
+        parser.error('program_dir is required')
     program = get_program(args.program_dir, args.cgroup)
 
     if args.show_example:
         show_example(problem_def['defaults'], next(problem_cases)[1])
         sys.exit()
 
+    if args.stdio:
+        problem_def['defaults']['input_file'] = '<stdin>'
+        problem_def['defaults']['output_file'] = '<stdout>'
+
+    calibration = {}
+    if grading:
+        calibration = grading.load_calibration(args.calibration_file)
+
+    def get_case_scale(case_num):
+        if grading is None:
+            return 1.0
+        return grading.get_case_scale(
+            calibration, testset_key, args.problem, case_num, 1.0)
+
+    if args.calibrate:
+        factors = grading.calibrate_cases(
+            run_and_score_case, ValidatorException, program,
+            problem_def['defaults'], problem_cases, problem_validator,
+            args.calibration_repeats)
+        calibration.setdefault(testset_key, {}).setdefault(
+            args.problem, {}).update(factors)
+        with open(args.calibration_file, 'w') as calibration_f:
+            yaml.safe_dump(calibration, calibration_f,
+                           default_flow_style=False)
+        print('\nCalibrated %d cases, results saved in %s.' % (
+            len(factors), args.calibration_file))
+        sys.exit()
+
+    if args.compare:
+        programs = [program, get_program(args.compare, args.cgroup)]
+        timeout_multiplier = float(args.timeout_multiplier) if args.timeout_multiplier and float(args.timeout_multiplier) > 1 else 1
+        grading.compare_programs(
+            run_and_score_case, ValidatorException, programs,
+            problem_def['defaults'], problem_cases, problem_validator,
+            lambda case_num: timeout_multiplier * get_case_scale(case_num),
+            args.compare_repeats)
+        sys.exit()
+
+    host = solution = None
+    if grading:
+        host = grading.get_host_fingerprint()
+        solution = grading.get_solution_hash([args.program_dir])
+    json_out = None
+    if args.json_out:
+        json_out = open(args.json_out, 'w')
+    if history:
+        history.start_run(solution, program, testset_key, args.problem, host)
+        if args.history_order:
+            problem_cases = list(problem_cases)
+            case_order = history.case_order(
+                testset_key, args.problem,
+                [case_num for case_num, _ in problem_cases])
+            problem_cases = sorted(
+                problem_cases,
+                key=lambda case: case_order.index(case[0]))
+
     failed_cases = []
     ok_cases = []
     t_start = time.time()
     for case_num, case_def in problem_cases:
         print('Running case %d... ' % (case_num,), end='')
+        case_scale = get_case_scale(case_num)
+        case_meas, case_phases, message = {}, {}, None
         try:
             timeout_multiplier = float(args.timeout_multiplier) if args.timeout_multiplier and float(args.timeout_multiplier) > 1 else 1
             if args.stdio:
@@ -396,13 +726,31 @@ if __name__ == '__main__':
                 case_def['output_file'] = '<stdout>'
             case_meas = run_and_score_case(
                 program, problem_def['defaults'], case_def,
-                problem_validator, timeout_multiplier)
+                problem_validator, timeout_multiplier * case_scale,
+                phases=case_phases)
             ok_cases.append((case_num, case_meas))
             print('OK!')
         except ValidatorException as e:
+            message = str(e)
+            case_meas = e.measurements
             failed_cases.append(case_num)
             print('Failed:')
-            print(str(e))
+            print(message)
+        if json_out:
+            grading.write_json_record(json_out, {
+                'type': 'case',
+                'problem': args.problem,
+                'case': case_num,
+                'status': 'failed' if message is not None else 'ok',
+                'message': message,
+                'measurements': case_meas,
+                'phases': case_phases,
+                'timeout_scale': case_scale,
+                'host': host,
+                'solution': solution,
+                })
+        if history:
+            history.add_result(case_num, message, case_meas)
         sys.stdout.flush()
     tot_time = time.time() - t_start
     print('\nValidation result: %d/%d cases pass. Eval time: %f\n' % (
@@ -415,6 +763,20 @@ if __name__ == '__main__':
     for k, v in tot_meas.items():
         print("For passing cases total %s: %s" % (k, v))
 
+    if json_out:
+        grading.write_json_record(json_out, {
+            'type': 'summary',
+            'problem': args.problem,
+            'passed': len(ok_cases),
+            'total': len(ok_cases) + len(failed_cases),
+            'failed_cases': failed_cases,
+            'totals': tot_meas,
+            'eval_time': tot_time,
+            'host': host,
+            'solution': solution,
+            })
+        json_out.close()
+
     if args.results:
         with open(args.results, 'a') as rf:
             rf.write('%s, %d, %f, %f\n' %
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+'''
+Pomiar szybkości sprawdzania obrazków w sprawdzarce nonogramów. Przykład:
+
+  `python nonogram_benchmark.py --size 200 --count 1000`
+
+Dla losowych obrazków podanego rozmiaru wypisuje, ile obrazków na sekundę
+sprawdza każda z metod: `count_blocks` (pętla w Pythonie), `run_lengths`
+(NumPy) i `bitpacked` (obrazek spakowany w jedną liczbę całkowitą).
+'''
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import time
+
+import numpy as np
+
+import ai_nonogram_validator as validator
+
+
+def random_case(rng, size, density):
+    img = (rng.random_sample((size, size)) < density).astype(np.int8)
+    lines = ([validator.count_blocks(r) for r in img] +
+             [validator.count_blocks(r) for r in img.T])
+    inp = '\n'.join(
+        ['%d %d' % img.shape] + [' '.join(map(str, l)) for l in lines])
+    out = '\n'.join(''.join('#' if c else '.' for c in r) for r in img)
+    return {'inp': inp, 'out': out}
+
+
+def check_count_blocks(clues, img):
+    return ([validator.count_blocks(r) for r in img] +
+            [validator.count_blocks(r) for r in img.T]) == clues
+
+
+def check_run_lengths(clues, img):
+    return (validator.first_mismatch(
+                clues['rows'], validator.run_lengths(img)) is None and
+            validator.first_mismatch(
+                clues['cols'], validator.run_lengths(img.T)) is None)
+
+
+def check_bitpacked(clues, img):
+    for lines, line_clues in ((img, clues['rows']), (img.T, clues['cols'])):
+        bits, width = validator.pack_image(lines)
+        runs = validator.bit_run_lengths(bits, lines.shape[0], width)
+        if validator.first_mismatch(line_clues, runs) is not None:
+            return False
+    return True
+
+
+def get_argparser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--size', default=200, type=int,
+        help='Number of rows and columns of the images.')
+    parser.add_argument(
+        '--count', default=200, type=int,
+        help='Number of images.')
+    parser.add_argument(
+        '--density', default=0.5, type=float,
+        help='Probability that a cell is filled.')
+    parser.add_argument(
+        '--seed', default=0, type=int,
+        help='Random seed.')
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_argparser().parse_args()
+    rng = np.random.RandomState(args.seed)
+    cases = [random_case(rng, args.size, args.density)
+             for _ in range(args.count)]
+    images = [validator.parse_image(case['out'], (args.size, args.size))
+              for case in cases]
+    methods = [
+        ('count_blocks', check_count_blocks,
+         lambda case: [[int(i) for i in l.split()]
+                       for l in case['inp'].split('\n')[1:]]),
+        ('run_lengths', check_run_lengths, validator.compile_nonogram_case),
+        ('bitpacked', check_bitpacked, validator.compile_nonogram_case),
+        ]
+    print('%d images %dx%d:' % (args.count, args.size, args.size))
+    for name, check, compile_case in methods:
+        clues = [compile_case(case) for case in cases]
+        start = time.time()
+        for case_clues, img in zip(clues, images):
+            assert check(case_clues, img)
+        elapsed = time.time() - start
+        print('  %-12s %10.1f grids/s' % (name, args.count / elapsed))
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+'''
+Generator obrazków logicznych dla sprawdzarki. Przykład użycia:
+
+  `python nonogram_generator.py --count 100 --height 30 --width 30 --output losowe`
+  `python ai_nonogram_validator.py --testset losowe_quick.yaml obrazki_XXXX`
+  `python ai_nonogram_validator.py --testset losowe_heavy.yaml obrazki_XXXX`
+
+Obrazki są losowane, a zostają tylko te o jednoznacznym rozwiązaniu
+(sprawdzanym przez `nonogram_solver.py`). Pole `difficulty` to liczba
+rozwiązanych linii potrzebnych do wykazania jednoznaczności. Najtrudniejsza
+część wygenerowanych obrazków (domyślnie ćwiartka, `--heavy-fraction`)
+trafia do zestawu `_heavy`, pozostałe do `_quick`. Opcja `--heavy-difficulty`
+zamiast tego wybiera obrazki o co najmniej podanej trudności.
+'''
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import multiprocessing
+import random
+import sys
+
+import numpy as np
+
+import ai_nonogram_validator as validator
+import nonogram_solver
+
+
+def case_from_image(img):
+    lines = ([validator.count_blocks(r) for r in img] +
+             [validator.count_blocks(r) for r in img.T])
+    inp = '\n'.join(
+        ['%d %d' % img.shape] + [' '.join(map(str, l)) for l in lines])
+    out = '\n'.join(''.join('#' if c else '.' for c in r) for r in img)
+    return {'inp': inp + '\n', 'out': out + '\n'}
+
+
+def generate_nonogram(params):
+    """
+    Generate one puzzle with a unique solution. Returns a test case with its
+    difficulty, fails after max_attempts puzzles.
+    """
+    seed, height, width, density, time_limit, max_attempts = params
+    rng = random.Random(seed)
+    for _ in range(max_attempts):
+        img = np.array([[int(rng.random() < density) for _ in range(width)]
+                        for _ in range(height)])
+        case = case_from_image(img)
+        try:
+            solver, solutions = nonogram_solver.solve_case(
+                case, time_limit=time_limit)
+        except validator.ValidatorException:
+            continue
+        if len(solutions) == 1:
+            case['difficulty'] = solver.num_lines
+            return case
+    validator.fail(
+        'No unique %dx%d puzzle with density %s found in %d attempts '
+        '(seed %s).' % (height, width, density, max_attempts, seed))
+
+
+def get_argparser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--count', default=20, type=int,
+        help='Number of puzzles to generate.')
+    parser.add_argument(
+        '--height', default=20, type=int,
+        help='Number of rows.')
+    parser.add_argument(
+        '--width', default=20, type=int,
+        help='Number of columns.')
+    parser.add_argument(
+        '--density', default=0.6, type=float,
+        help='Probability that a cell is filled, denser images are more '
+             'often unique.')
+    parser.add_argument(
+        '--heavy-fraction', default=0.25, type=float,
+        help='Fraction of the generated puzzles, the most difficult ones, '
+             'that go to the heavy test set.')
+    parser.add_argument(
+        '--heavy-difficulty', default=None, type=int,
+        help='Puzzles with at least that difficulty go to the heavy test '
+             'set, instead of --heavy-fraction.')
+    parser.add_argument(
+        '--quick-timeout', default=3.0, type=float,
+        help='Timeout of the quick test set, in seconds.')
+    parser.add_argument(
+        '--heavy-timeout', default=12.0, type=float,
+        help='Timeout of the heavy test set, in seconds.')
+    parser.add_argument(
+        '--solver-time', default=10.0, type=float,
+        help='Time limit of the solver per puzzle, puzzles whose uniqueness '
+             'is not decided in time are dropped.')
+    parser.add_argument(
+        '--max-attempts', default=1000, type=int,
+        help='Give up after that many rejected puzzles for one test case.')
+    parser.add_argument(
+        '--processes', default=multiprocessing.cpu_count(), type=int,
+        help='Number of generator processes.')
+    parser.add_argument(
+        '--seed', default=0, type=int,
+        help='Random seed, the same seed gives the same puzzles.')
+    parser.add_argument(
+        '--problem', default='zad1',
+        help='Problem name in the written test sets.')
+    parser.add_argument(
+        '--output', required=True,
+        help='Prefix of the written test sets, PREFIX_quick.yaml and '
+             'PREFIX_heavy.yaml.')
+    return parser
+
+
+def split_tiers(cases, heavy_fraction, heavy_difficulty=None):
+    """
+    Split cases into the quick and heavy tiers, sorted by difficulty. Without
+    heavy_difficulty the heavy tier gets the heavy_fraction most difficult
+    cases, so that it is not empty whatever difficulties the generator
+    parameters give.
+    """
+    cases = sorted(cases, key=lambda case: case['difficulty'])
+    if heavy_difficulty is None:
+        num_quick = len(cases) - int(round(len(cases) * heavy_fraction))
+    else:
+        num_quick = sum(
+            1 for case in cases if case['difficulty'] < heavy_difficulty)
+    return {'quick': cases[:num_quick], 'heavy': cases[num_quick:]}
+
+
+if __name__ == '__main__':
+    parser = get_argparser()
+    args = parser.parse_args()
+    if not 0 <= args.heavy_fraction <= 1:
+        parser.error('--heavy-fraction must be between 0 and 1')
+    # Every puzzle has its own seed, distinct for all (--seed, puzzle) pairs.
+    params = [('%d-%d' % (args.seed, i), args.height, args.width,
+               args.density, args.solver_time, args.max_attempts)
+              for i in range(args.count)]
+    pool = multiprocessing.Pool(args.processes)
+    cases = []
+    try:
+        for num_done, case in enumerate(
+                pool.imap(generate_nonogram, params), 1):
+            cases.append(case)
+            print('Generated puzzle %d/%d, difficulty %d.' % (
+                num_done, args.count, case['difficulty']))
+            sys.stdout.flush()
+    except validator.ValidatorException as e:
+        pool.terminate()
+        sys.exit(str(e))
+    pool.close()
+    pool.join()
+
+    tiers = split_tiers(cases, args.heavy_fraction, args.heavy_difficulty)
+    for tier, timeout in (('quick', args.quick_timeout),
+                          ('heavy', args.heavy_timeout)):
+        cases = tiers[tier]
+        if not cases:
+            print('Warning: no puzzles in the %s test set, adjust '
+                  '--heavy-fraction or --heavy-difficulty.' % (tier,),
+                  file=sys.stderr)
+        testset = {args.problem: {
+            'defaults': {
+                'timeout': timeout,
+                'input_file': '<stdin>',
+                'output_file': '<stdout>',
+                },
+            'validator': 'nonogram_validator',
+            'cases': cases,
+            }}
+        with open('%s_%s.yaml' % (args.output, tier), 'w') as testset_f:
+            validator.dump_testset(testset, testset_f)
+        print('Wrote %d puzzles to %s_%s.yaml%s.' % (
+            len(cases), args.output, tier,
+            ', difficulties %d-%d' % (cases[0]['difficulty'],
+                                      cases[-1]['difficulty'])
+            if cases else ''))
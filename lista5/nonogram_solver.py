@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+'''
+Rozwiązanie wzorcowe obrazków logicznych (nonogramów). Przykłady użycia:
+
+1. Sprawdzenie, czy obrazki z zestawu testów mają jednoznaczne rozwiązania
+   zgodne z polem `out`:
+  `python nonogram_solver.py --testset quick_nonograms_tests.yaml zad1`
+
+2. Uzupełnienie pola `out` rozwiązaniami wzorcowymi:
+  `python nonogram_solver.py --testset nowe.yaml --output nowe_z_out.yaml zad1`
+
+Linie są rozwiązywane programowaniem dynamicznym na bitach (zbiory pozycji
+są liczbami całkowitymi), wnioski są propagowane między wierszami
+i kolumnami, a gdy propagacja nie wystarcza, rozwiązanie jest zgadywane
+z nawrotami.
+'''
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import time
+
+import yaml
+
+import ai_nonogram_validator as validator
+
+
+def parse_clues(inp):
+    """
+    Returns the row and column clues of a case, empty lines have no blocks.
+    """
+    lines = [[int(i) for i in l.split()] for l in inp.split('\n') if l.strip()]
+    num_rows, num_cols = lines[0]
+    clues = [[b for b in l if b > 0] for l in lines[1:]]
+    return clues[:num_rows], clues[num_rows:num_rows + num_cols]
+
+
+def spans(bits, length):
+    """Bit i is set if bits i..i+length-1 are all set."""
+    result = bits
+    for shift in range(1, length):
+        result &= bits >> shift
+    return result
+
+
+def smear(bits, length):
+    """Bit i is set if any of bits i-length+1..i is set."""
+    result = bits
+    for shift in range(1, length):
+        result |= bits << shift
+    return result
+
+
+def empty_runs(n, can_empty):
+    """
+    Masks for advancing over runs of 1, 2, 4, ... empty cells: bit i of the
+    k-th mask is set if cells i..i+2**k-1 can all be empty.
+    """
+    masks = []
+    mask = can_empty
+    step = 1
+    while step <= n and mask:
+        masks.append((step, mask))
+        mask &= mask >> step
+        step *= 2
+    return masks
+
+
+def solve_line(n, clue, filled, empty):
+    """
+    Finds the cells that are filled or empty in every placement of the clue
+    blocks consistent with the known `filled` and `empty` cells (bitsets of
+    the n cells). Returns the new (filled, empty), or None if the line has
+    no consistent placement.
+
+    The line gets an extra empty cell n, so that every block is followed by
+    an empty cell. Sets of cuts 0..n+1 between cells are bitsets as well: bit
+    i of fwd[j] is set if cells 0..i-1 can hold the first j blocks and cell
+    i-1 (if any) is empty, bit i of suf[j] if cells i..n can hold the blocks
+    from j on. Runs of empty cells are crossed in a logarithmic number of
+    shifts.
+    """
+    full = (1 << n) - 1
+    can_empty = (full & ~filled) | (1 << n)
+    can_fill = full & ~empty
+    runs = empty_runs(n + 1, can_empty)
+    k = len(clue)
+
+    def forward_gaps(cuts):
+        for step, mask in runs:
+            cuts |= (cuts & mask) << step
+        return cuts
+
+    def backward_gaps(cuts):
+        for step, mask in runs:
+            cuts |= (cuts >> step) & mask
+        return cuts
+
+    def starts(length, cuts):
+        """Block starts from which the block and an empty cell reach cuts."""
+        return (spans(can_fill, length) & (can_empty >> length) &
+                (cuts >> (length + 1)))
+
+    fwd = [forward_gaps(1)]
+    for length in clue:
+        at_start = fwd[-1] & spans(can_fill, length) & (can_empty >> length)
+        fwd.append(forward_gaps(at_start << (length + 1)))
+    if not (fwd[k] >> (n + 1)) & 1:
+        return None
+    suf = [0] * k + [backward_gaps(1 << (n + 1))]
+    for j in range(k - 1, -1, -1):
+        suf[j] = backward_gaps(starts(clue[j], suf[j + 1]))
+
+    may_fill = 0
+    may_empty = 0
+    for j in range(k + 1):
+        may_empty |= (fwd[j] & suf[j]) >> 1
+        if j < k:
+            may_fill |= smear(fwd[j] & starts(clue[j], suf[j + 1]), clue[j])
+    return full & ~may_empty, full & ~may_fill
+
+
+class NonogramSolver(object):
+    """
+    Solves a nonogram by line solving with propagation and backtracking.
+    Known cells are kept as filled and empty bitsets of every row and every
+    column. When propagation stalls, cells are probed (both values are tried
+    and propagated) before the search branches. num_lines counts line
+    solver calls, num_probes probed cells and num_nodes search nodes, which
+    together measure how hard the puzzle is.
+    """
+
+    def __init__(self, row_clues, col_clues, time_limit=None):
+        self.row_clues = row_clues
+        self.col_clues = col_clues
+        self.time_limit = time_limit
+        self.start_time = time.time()
+        self.num_rows = len(row_clues)
+        self.num_cols = len(col_clues)
+        self.num_lines = 0
+        self.num_probes = 0
+        self.num_nodes = 0
+
+    def propagate(self, state, dirty):
+        """
+        Solves dirty lines until nothing changes. State is a list of
+        [filled, empty] bitsets, rows first, then columns. Returns False on
+        a contradiction.
+        """
+        num_rows = self.num_rows
+        clues = self.row_clues + self.col_clues
+        while dirty:
+            line = dirty.pop()
+            if line < num_rows:
+                n, other, offset = self.num_cols, line, num_rows
+            else:
+                n, other, offset = num_rows, line - num_rows, 0
+            filled, empty = state[line]
+            self.num_lines += 1
+            solved = solve_line(n, clues[line], filled, empty)
+            if solved is None:
+                return False
+            for kind in (0, 1):
+                new = solved[kind] & ~state[line][kind]
+                state[line][kind] |= new
+                while new:
+                    low = new & -new
+                    cross = offset + low.bit_length() - 1
+                    state[cross][kind] |= 1 << other
+                    dirty.add(cross)
+                    new ^= low
+        return True
+
+    def unknown_cells(self, state):
+        full = (1 << self.num_cols) - 1
+        for r in range(self.num_rows):
+            unknown = full & ~(state[r][0] | state[r][1])
+            while unknown:
+                low = unknown & -unknown
+                yield r, low.bit_length() - 1
+                unknown ^= low
+
+    def assume(self, state, r, c, kind):
+        """Copy of the state with cell (r, c) set and propagated, or None."""
+        child = [list(line) for line in state]
+        child[r][kind] |= 1 << c
+        child[self.num_rows + c][kind] |= 1 << r
+        if self.propagate(child, {r, self.num_rows + c}):
+            return child
+        return None
+
+    def probe(self, state):
+        """
+        Tries both values of every unknown cell. A value that leads to a
+        contradiction fixes the other one, and cells that get the same value
+        either way are fixed too. Updates the state in place and returns the
+        cell whose weaker value determines the most cells, None when the
+        state is solved, or False on a contradiction.
+        """
+        changed = True
+        while changed:
+            changed = False
+            best = None
+            for r, c in self.unknown_cells(state):
+                if (state[r][0] | state[r][1]) >> c & 1:
+                    continue  # fixed by an earlier probe in this sweep
+                self.num_probes += 1
+                children = [self.assume(state, r, c, kind) for kind in (0, 1)]
+                if children[0] is None and children[1] is None:
+                    return False
+                if children[0] is None or children[1] is None:
+                    state[:] = children[0] or children[1]
+                    changed = True
+                    continue
+                gains = []
+                for kind in (0, 1):
+                    common = [a[kind] & b[kind]
+                              for a, b in zip(children[0], children[1])]
+                    if any(x & ~line[kind] for x, line in zip(common, state)):
+                        for line, x in zip(state, common):
+                            line[kind] |= x
+                        changed = True
+                    gains.append(sum(bin(f | e).count('1')
+                                     for f, e in children[kind]))
+                if best is None or min(gains) > best[0]:
+                    best = (min(gains), r, c)
+        return best and best[1:]
+
+    def search(self, state, dirty, solutions, max_solutions):
+        self.num_nodes += 1
+        if (self.time_limit and
+                time.time() - self.start_time > self.time_limit):
+            validator.fail('Solver time limit of %f s exceeded after %d '
+                           'search nodes' % (self.time_limit, self.num_nodes))
+        if not self.propagate(state, dirty):
+            return
+        cell = self.probe(state)
+        if cell is False:
+            return
+        if cell is None:
+            solutions.append([filled for filled, _ in state[:self.num_rows]])
+            return
+        r, c = cell
+        for kind in (0, 1):
+            if len(solutions) >= max_solutions:
+                return
+            child = [list(line) for line in state]
+            child[r][kind] |= 1 << c
+            child[self.num_rows + c][kind] |= 1 << r
+            self.search(child, {r, self.num_rows + c}, solutions,
+                        max_solutions)
+
+    def solve(self, max_solutions=2):
+        """
+        Returns up to max_solutions solutions, each a list of row bitsets
+        (bit c is column c). Two solutions mean the puzzle is not unique.
+        """
+        solutions = []
+        if (sum(map(sum, self.row_clues)) != sum(map(sum, self.col_clues))):
+            return solutions
+        state = [[0, 0] for _ in range(self.num_rows + self.num_cols)]
+        self.search(state, set(range(len(state))), solutions, max_solutions)
+        return solutions
+
+    def to_string(self, solution):
+        return '\n'.join(
+            ''.join('#' if (row >> c) & 1 else '.'
+                    for c in range(self.num_cols))
+            for row in solution) + '\n'
+
+
+def solve_case(case, max_solutions=2, time_limit=None):
+    """Returns the solver, after solving, and its solutions."""
+    solver = NonogramSolver(*parse_clues(case['inp']), time_limit=time_limit)
+    return solver, solver.solve(max_solutions)
+
+
+def get_argparser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--testset', default='quick_nonograms_tests.yaml',
+        help='YAML test set file.')
+    parser.add_argument(
+        '--cases', default='',
+        help='Comma-separated list of test cases to solve, e.g. 1,2,3-6.')
+    parser.add_argument(
+        '--time-limit', default=60.0, type=float,
+        help='Time limit per case in seconds, the uniqueness of harder '
+             'puzzles is not decided.')
+    parser.add_argument(
+        '--output', default='',
+        help='Write the test set with `out` filled in to this file.')
+    parser.add_argument(
+        'problem',
+        help='Problem to solve, e.g. zad1.')
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_argparser().parse_args()
+    with open(args.testset) as testset_f:
+        testset = yaml.safe_load(testset_f)
+    problem_def = testset[args.problem]
+    for case_num, case_def in validator.get_cases(problem_def, args.cases):
+        start = time.time()
+        try:
+            solver, solutions = solve_case(case_def, time_limit=args.time_limit)
+        except validator.ValidatorException as e:
+            print('Case %d failed: %s' % (case_num, e))
+            continue
+        elapsed = time.time() - start
+        if not solutions:
+            print('Case %d has no solution!' % (case_num,))
+            continue
+        image = solver.to_string(solutions[0])
+        validator.nonogram_validator(case_def, image)
+        print('Case %d: %s in %f s, %d lines solved, %d cells probed, '
+              '%d search nodes.' % (
+                  case_num, 'unique' if len(solutions) == 1 else 'NOT UNIQUE',
+                  elapsed, solver.num_lines, solver.num_probes,
+                  solver.num_nodes))
+        if ('out' in case_def and len(solutions) == 1 and
+                validator.whitespace_normalize(case_def['out']) !=
+                validator.whitespace_normalize(image)):
+            print('The stored out differs from the solution!')
+        if args.output:
+            case_def['out'] = image
+    if args.output:
+        with open(args.output, 'w') as testset_f:
+            validator.dump_testset(testset, testset_f)